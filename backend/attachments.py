@@ -0,0 +1,238 @@
+"""
+This file handles files attached to particles.
+
+Blobs are stored once per distinct content under blob_dir/<sha[:2]>/<sha>,
+while the attachments table maps particles to blobs with their filename and type.
+
+Placing a blob and dropping an unreferenced one both happen inside a write
+transaction, next to the row insert or delete. The write lock serializes them,
+so an upload can't reuse a blob that a concurrent delete is about to unlink.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import database
+
+
+class AttachmentTooLarge(Exception):
+    """
+    Raised when an upload grows past the configured size limit.
+    """
+
+
+def blob_path(sha256: str) -> Path:
+    """
+    Return where the blob with the given digest lives on disk.
+
+    Args:
+        sha256 (str): Hex SHA-256 digest of the content.
+
+    Returns:
+        Path: Blob file path.
+    """
+    return Path(database.settings().blob_dir) / sha256[:2] / sha256
+
+
+async def store_blob(chunks: AsyncIterator[bytes]) -> tuple:
+    """
+    Stream an upload into a temporary file in the blob store, hashing it on the way.
+
+    Chunks go straight to disk, so the upload is never held in memory. The file
+    only becomes a blob when add_attachment records it.
+
+    Args:
+        chunks (AsyncIterator[bytes]): Upload body.
+
+    Returns:
+        tuple: (sha256, size, staged path) of the uploaded content.
+
+    Raises:
+        AttachmentTooLarge: If the body exceeds max_attachment_bytes.
+    """
+    limit = database.settings().max_attachment_bytes
+    tmp_dir = Path(database.settings().blob_dir) / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > limit:
+                    raise AttachmentTooLarge()
+                digest.update(chunk)
+                await run_in_threadpool(tmp.write, chunk)
+
+        return digest.hexdigest(), size, Path(tmp_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def add_attachment(article_id: int, sha256: str, size: int, filename: str, content_type: str, staged: Path) -> int:
+    """
+    Record an uploaded file as an attachment of a particle.
+
+    The staged file becomes the blob unless one with the same digest already
+    exists, in which case it is dropped. Both happen while the row insert holds
+    the write lock, so a concurrent delete of the last other reference can't
+    unlink the blob in between.
+
+    Args:
+        article_id (int): Particle ID.
+        sha256 (str): Blob digest.
+        size (int): Blob size in bytes.
+        filename (str): Original filename.
+        content_type (str): MIME type sent by the client.
+        staged (Path): Temporary file from store_blob.
+
+    Returns:
+        int: Attachment ID.
+    """
+    def insert(conn):
+        cursor = conn.execute(
+            "INSERT INTO attachments (article_id, sha256, size, filename, content_type, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (article_id, sha256, size, filename, content_type, int(time.time())),
+        )
+        final = blob_path(sha256)
+        if not final.exists():
+            final.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staged, final)
+        return cursor.lastrowid
+
+    conn = database.connect()
+    try:
+        return database.execute_transaction(conn, insert)
+    finally:
+        conn.close()
+        staged.unlink(missing_ok=True)
+
+
+def list_attachments(article_id: int):
+    """
+    Return the attachments of a particle.
+
+    Args:
+        article_id (int): Particle ID.
+
+    Returns:
+        list[dict]: Attachment metadata.
+    """
+    conn = database.connect()
+    rows = conn.execute(
+        "SELECT id, sha256, size, filename, content_type, created FROM attachments WHERE article_id = ? ORDER BY id",
+        (article_id,),
+    ).fetchall()
+    conn.close()
+    return [
+        {
+            "attachment_id": row[0],
+            "sha256": row[1],
+            "size": row[2],
+            "filename": row[3],
+            "content_type": row[4],
+            "created": row[5],
+        }
+        for row in rows
+    ]
+
+
+def get_attachment(attachment_id: int) -> Optional[dict]:
+    """
+    Return one attachment with its owner and blob path.
+
+    Args:
+        attachment_id (int): Attachment ID.
+
+    Returns:
+        dict or None: Attachment details or None if not found.
+    """
+    conn = database.connect()
+    row = conn.execute(
+        """
+        SELECT a.article_id, p.username, a.sha256, a.size, a.filename, a.content_type
+        FROM attachments a JOIN particles p ON p.article_id = a.article_id
+        WHERE a.id = ?
+        """,
+        (attachment_id,),
+    ).fetchone()
+    conn.close()
+
+    if not row:
+        return None
+    return {
+        "article_id": row[0],
+        "username": row[1],
+        "sha256": row[2],
+        "size": row[3],
+        "filename": row[4],
+        "content_type": row[5],
+        "path": blob_path(row[2]),
+    }
+
+
+def _drop_unreferenced(conn, digests) -> None:
+    """
+    Delete blob files no attachment row points at any more. Runs inside the
+    caller's write transaction, after the rows were deleted.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        digests (Iterable[str]): Digests whose rows were just removed.
+    """
+    for sha256 in set(digests):
+        still_used = conn.execute("SELECT 1 FROM attachments WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        if not still_used:
+            blob_path(sha256).unlink(missing_ok=True)
+
+
+def delete_attachment(attachment_id: int) -> bool:
+    """
+    Delete an attachment, and its blob if nothing else shares it.
+
+    Args:
+        attachment_id (int): Attachment ID.
+
+    Returns:
+        bool: True if deleted, False otherwise.
+    """
+    def delete(conn):
+        row = conn.execute("SELECT sha256 FROM attachments WHERE id = ?", (attachment_id,)).fetchone()
+        if not row:
+            return False
+        conn.execute("DELETE FROM attachments WHERE id = ?", (attachment_id,))
+        _drop_unreferenced(conn, [row[0]])
+        return True
+
+    conn = database.connect()
+    deleted = database.execute_transaction(conn, delete)
+    conn.close()
+    return deleted
+
+
+def delete_for_article(article_id: int) -> None:
+    """
+    Delete every attachment of a particle.
+
+    Args:
+        article_id (int): Particle ID.
+    """
+    def delete(conn):
+        digests = [row[0] for row in conn.execute("SELECT sha256 FROM attachments WHERE article_id = ?", (article_id,))]
+        if digests:
+            conn.execute("DELETE FROM attachments WHERE article_id = ?", (article_id,))
+            _drop_unreferenced(conn, digests)
+
+    conn = database.connect()
+    database.execute_transaction(conn, delete)
+    conn.close()
@@ -6,26 +6,53 @@ import sqlite3
 import bcrypt
 import secrets
 import hashlib
+import threading
 import time
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-DB_PATH = "db/pim.db"
+import config
+import database
+
 SESSION_EXPIRY = 120 * 60  # 120 minutes
+USER_INDEX_TTL = 0.25  # seconds between checks for registrations/deletions in other workers
+USERNAME_CHANGES_KEEP = 1000  # username_changes rows kept; an index further behind reloads in full
+MIN_BCRYPT_ROUNDS = 10  # calibration never goes below this, however slow the host
+MAX_BCRYPT_ROUNDS = 16
+
+# bcrypt work factor for new hashes; set by configure_bcrypt
+_bcrypt_rounds = 12
+_bcrypt_calibration = None
+
+# One background thread upgrades outdated hashes after successful logins
+_rehash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pim-rehash")
+_rehash_pending = set()
+_rehash_lock = threading.Lock()
+
+# In-memory set of every username, so unknown users and duplicate
+# registrations are answered without touching SQLite or bcrypt
+_user_index = set()
+_user_index_settings = None
+_user_index_revision = None
+_user_index_checked = 0.0
+_user_index_lock = threading.Lock()
+
+_dummy_hash = None
 
 # HELPER FUNCTIONS
-def hash_password(password: str) -> str:
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
     """
     Generate a salted bcrypt hash for the given password.
 
     Args:
         password (str): The plaintext password.
+        rounds (Optional[int]): bcrypt cost, defaults to the configured one.
 
     Returns:
         str: The bcrypt hash as a string.
     """
     
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or _bcrypt_rounds)
     return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
 
 
@@ -44,6 +71,157 @@ def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
 
 
+def hash_cost(hashed: str) -> int:
+    """
+    Return the work factor a bcrypt hash was made with.
+
+    Args:
+        hashed (str): The bcrypt hash, e.g. "$2b$12$...".
+
+    Returns:
+        int: The cost (log2 of the number of rounds).
+    """
+    return int(hashed.split("$")[2])
+
+
+def _verify_ms(rounds: int) -> float:
+    """
+    Time one bcrypt verify at the given cost, in milliseconds.
+    """
+    hashed = bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=rounds))
+    started = time.perf_counter()
+    bcrypt.checkpw(b"calibration", hashed)
+    return (time.perf_counter() - started) * 1000
+
+
+def calibrate_bcrypt(target_ms: float, min_rounds: int = MIN_BCRYPT_ROUNDS, max_rounds: int = MAX_BCRYPT_ROUNDS) -> dict:
+    """
+    Find the highest bcrypt cost whose verify takes at most target_ms on this host.
+
+    Each extra round doubles the work, so the cost is extrapolated from one
+    cheap measurement and then confirmed by timing the chosen cost, stepping
+    down while the timing is over target. measured_ms is always a real timing;
+    samples that were only extrapolated are listed in "estimated".
+
+    Args:
+        target_ms (float): Target verify latency in milliseconds.
+        min_rounds (int): Lowest cost allowed.
+        max_rounds (int): Highest cost allowed.
+
+    Returns:
+        dict: {"rounds", "target_ms", "measured_ms", "samples", "estimated", "calibrated_at"}.
+    """
+    samples = {min_rounds: _verify_ms(min_rounds)}
+    measured = {min_rounds}
+    rounds = min_rounds
+    while rounds < max_rounds and samples[rounds] * 2 <= target_ms:
+        rounds += 1
+        # Measure only once the estimate gets close to the target
+        estimate = samples[rounds - 1] * 2
+        if estimate * 2 > target_ms:
+            samples[rounds] = _verify_ms(rounds)
+            measured.add(rounds)
+        else:
+            samples[rounds] = estimate
+
+    while True:
+        if rounds not in measured:
+            samples[rounds] = _verify_ms(rounds)
+            measured.add(rounds)
+        if rounds == min_rounds or samples[rounds] <= target_ms:
+            break
+        rounds -= 1
+    return {
+        "rounds": rounds,
+        "target_ms": target_ms,
+        "measured_ms": round(samples[rounds], 2),
+        "samples": {str(r): round(ms, 2) for r, ms in samples.items()},
+        "estimated": [str(r) for r in samples if r not in measured],
+        "calibrated_at": int(time.time()),
+    }
+
+
+def configure_bcrypt(settings: config.Config) -> dict:
+    """
+    Set the cost of new hashes: fixed by settings.bcrypt_rounds, taken from
+    settings.bcrypt_calibration (calibrated once by serve.py for all workers),
+    or calibrated here against settings.bcrypt_target_ms.
+
+    Args:
+        settings (config.Config): Configuration to use.
+
+    Returns:
+        dict: Calibration details (see calibrate_bcrypt).
+    """
+    global _bcrypt_rounds, _bcrypt_calibration, _dummy_hash
+    if settings.bcrypt_rounds:
+        calibration = {"rounds": settings.bcrypt_rounds, "target_ms": None, "fixed": True}
+    elif settings.bcrypt_calibration:
+        calibration = settings.bcrypt_calibration
+    else:
+        calibration = calibrate_bcrypt(settings.bcrypt_target_ms)
+    _bcrypt_rounds = calibration["rounds"]
+    _bcrypt_calibration = calibration
+    _dummy_hash = None  # regenerate at the new cost
+    return calibration
+
+
+def bcrypt_report() -> dict:
+    """
+    Return the calibration result and how many stored hashes use each cost.
+
+    Returns:
+        dict: {"rounds", "calibration", "cost_distribution"}.
+    """
+    conn = database.connect()
+    # Rows that aren't bcrypt hashes (legacy plaintext) are counted as "unhashed"
+    rows = conn.execute(
+        """
+        SELECT CASE WHEN password LIKE '$2_$%' THEN CAST(substr(password, 5, 2) AS INTEGER) ELSE 'unhashed' END AS cost,
+               COUNT(*)
+        FROM auth GROUP BY cost ORDER BY cost
+        """
+    ).fetchall()
+    conn.close()
+    return {
+        "rounds": _bcrypt_rounds,
+        "calibration": _bcrypt_calibration,
+        "cost_distribution": {str(cost): count for cost, count in rows},
+    }
+
+
+def _rehash(user_id: int, password: str, old_hash: str) -> None:
+    """
+    Replace a hash made at a lower cost, unless the password changed in the meantime.
+    """
+    try:
+        new_hash = hash_password(password)
+        conn = database.connect()
+        database.execute_write(
+            conn, "UPDATE auth SET password = ? WHERE id = ? AND password = ?", (new_hash, user_id, old_hash)
+        )
+        conn.close()
+    finally:
+        with _rehash_lock:
+            _rehash_pending.discard(user_id)
+
+
+def schedule_rehash(user_id: int, password: str, old_hash: str) -> None:
+    """
+    Rehash a password at the (higher) current cost in the background, once per user.
+
+    Args:
+        user_id (int): User ID.
+        password (str): The plaintext password that just verified.
+        old_hash (str): The outdated hash.
+    """
+    with _rehash_lock:
+        if user_id in _rehash_pending:
+            return
+        _rehash_pending.add(user_id)
+    _rehash_executor.submit(_rehash, user_id, password, old_hash)
+
+
 def hash_token(token: str) -> str:
     """
     Hash session token with SHA256 before storing in DB.
@@ -57,6 +235,120 @@ def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 
+def dummy_verify(password: str) -> None:
+    """
+    Spend the same time as a real password check, for users that don't exist.
+
+    Args:
+        password (str): The plaintext password.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    verify_password(password, _dummy_hash)
+
+
+# USERNAME INDEX
+def load_user_index() -> None:
+    """
+    (Re)load the username index from the database.
+    """
+    global _user_index, _user_index_settings, _user_index_revision, _user_index_checked
+    conn = database.connect()
+    # Read the position first: changes made in between are replayed again, which is harmless
+    revision = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM username_changes").fetchone()[0]
+    usernames = {row[0] for row in conn.execute("SELECT username FROM auth")}
+    conn.close()
+
+    with _user_index_lock:
+        _user_index = usernames
+        _user_index_settings = database.settings()
+        _user_index_revision = revision
+        _user_index_checked = time.monotonic()
+
+
+def user_exists(username: str) -> bool:
+    """
+    Check the username index.
+
+    With several worker processes the index polls username_changes at most
+    every USER_INDEX_TTL seconds and applies what other workers registered or
+    deleted since. A miss is never trusted on that schedule: the changes are
+    checked first (one primary-key range read), so a user registered on another
+    worker is found at once. A hit may be up to USER_INDEX_TTL stale; callers
+    still read the user's row.
+
+    Args:
+        username (str): Username.
+
+    Returns:
+        bool: True if the user exists.
+    """
+    settings = database.settings()
+    if _user_index_settings is not settings:
+        load_user_index()
+    elif settings.workers > 1 and time.monotonic() - _user_index_checked > USER_INDEX_TTL:
+        _refresh_user_index()
+    if username in _user_index:
+        return True
+    if settings.workers > 1:
+        _refresh_user_index()
+        return username in _user_index
+    return False
+
+
+def _refresh_user_index() -> None:
+    """
+    Apply the username changes made since the index was last brought up to
+    date, reloading it in full only if they have been pruned already.
+    """
+    global _user_index_revision, _user_index_checked
+    _user_index_checked = time.monotonic()
+    conn = database.connect()
+    changes = conn.execute(
+        "SELECT revision, username, added FROM username_changes WHERE revision > ? ORDER BY revision",
+        (_user_index_revision,),
+    ).fetchall()
+    conn.close()
+    if not changes:
+        return
+    if changes[0][0] != _user_index_revision + 1:
+        load_user_index()
+        return
+
+    with _user_index_lock:
+        for revision, username, added in changes:
+            if added:
+                _user_index.add(username)
+            else:
+                _user_index.discard(username)
+        _user_index_revision = changes[-1][0]
+
+
+def log_username_change(conn: sqlite3.Connection, username: str, added: bool) -> None:
+    """
+    Record a registration or deletion for the other workers' indexes, inside
+    the caller's write transaction, and prune the oldest changes.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        username (str): Username.
+        added (bool): True for a registration, False for a deletion.
+    """
+    cursor = conn.execute("INSERT INTO username_changes (username, added) VALUES (?, ?)", (username, int(added)))
+    conn.execute("DELETE FROM username_changes WHERE revision <= ?", (cursor.lastrowid - USERNAME_CHANGES_KEEP,))
+
+
+def _index_add(username: str) -> None:
+    with _user_index_lock:
+        _user_index.add(username)
+
+
+def _index_discard(username: str) -> None:
+    with _user_index_lock:
+        _user_index.discard(username)
+
+
 # AUTH FUNCTIONS
 def login(username: str, password: str) -> Optional[str]:
     """
@@ -76,7 +368,12 @@ def login(username: str, password: str) -> Optional[str]:
     if not isinstance(username, str) or not username.isalnum() or len(username) > 64:
         return None
 
-    conn = sqlite3.connect(DB_PATH)
+    # Unknown users still pay for one bcrypt check, so timing doesn't reveal who exists
+    if not user_exists(username):
+        dummy_verify(password)
+        return None
+
+    conn = database.connect()
     cursor = conn.cursor()
 
     cursor.execute("SELECT id, password FROM auth WHERE username = ?", (username,))
@@ -84,20 +381,25 @@ def login(username: str, password: str) -> Optional[str]:
 
     if not row:
         conn.close()
+        dummy_verify(password)
         return None
 
     user_id, hashed_pw = row
     if verify_password(password, hashed_pw):
+        # Only ever upgrade: a lower calibration (slower host, lower target) must not weaken stored hashes
+        if hash_cost(hashed_pw) < _bcrypt_rounds:
+            schedule_rehash(user_id, password, hashed_pw)
+
         # Create a new session token
         token = secrets.token_hex(32)
         hashed = hash_token(token)
         expiry = int(time.time()) + SESSION_EXPIRY
 
-        cursor.execute(
+        database.execute_write(
+            conn,
             "INSERT INTO sessions (user_id, token, expiry) VALUES (?, ?, ?)",
             (user_id, hashed, expiry),
         )
-        conn.commit()
         conn.close()
         return token  # return raw token to user (hashed version is in DB)
     else:
@@ -115,7 +417,7 @@ def validate_session(token: str) -> Optional[int]:
     Returns:
         Optional[int]: user_id if valid, else None. """
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = database.connect()
     cursor = conn.cursor()
 
     hashed = hash_token(token)
@@ -128,6 +430,29 @@ def validate_session(token: str) -> Optional[int]:
     return None
 
 
+def session_username(token: str) -> Optional[str]:
+    """
+    Return the username behind a valid, unexpired session token.
+
+    Args:
+        token (str): Session token.
+
+    Returns:
+        Optional[str]: Username if the session is valid, else None.
+    """
+    conn = database.connect()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT a.username FROM sessions s JOIN auth a ON a.id = s.user_id WHERE s.token = ? AND s.expiry > ?",
+        (hash_token(token), int(time.time())),
+    )
+    row = cursor.fetchone()
+
+    conn.close()
+    return row[0] if row else None
+
+
 def add_new_user(
     username: str, password: str, admin_key: Optional[str] = None, master_admin_key: Optional[str] = None
 ) -> bool:
@@ -147,14 +472,21 @@ def add_new_user(
     if master_admin_key is not None and admin_key != master_admin_key:
         return False
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    # Known duplicates are rejected before paying for bcrypt
+    if user_exists(username):
+        return False
+
+    conn = database.connect()
 
     hashed_pw = hash_password(password)
 
+    def insert(conn):
+        conn.execute("INSERT INTO auth (username, password) VALUES (?, ?)", (username, hashed_pw))
+        log_username_change(conn, username, True)
+
     try:
-        cursor.execute("INSERT INTO auth (username, password) VALUES (?, ?)", (username, hashed_pw))
-        conn.commit()
+        database.execute_transaction(conn, insert)
+        _index_add(username)
         success = True
     except sqlite3.IntegrityError:
         success = False
@@ -175,15 +507,22 @@ def delete_user(username: str, password: str) -> bool:
     Returns:
         bool: True if deleted, False otherwise.
     """
-    conn = sqlite3.connect(DB_PATH)
+    if not user_exists(username):
+        return False
+
+    conn = database.connect()
     cursor = conn.cursor()
 
     cursor.execute("SELECT password FROM auth WHERE username = ?", (username,))
     row = cursor.fetchone()
     if row and verify_password(password, row[0]):
-        cursor.execute("DELETE FROM auth WHERE username = ?", (username,))
-        conn.commit()
-        deleted = cursor.rowcount > 0
+        def delete(conn):
+            cursor = conn.execute("DELETE FROM auth WHERE username = ?", (username,))
+            log_username_change(conn, username, False)
+            return cursor.rowcount > 0
+
+        deleted = database.execute_transaction(conn, delete)
+        _index_discard(username)
     else:
         deleted = False
 
@@ -203,7 +542,10 @@ def change_password(username: str, old_password: str, new_password: str) -> bool
     Returns:
         bool: True if changed, False otherwise.
     """
-    conn = sqlite3.connect(DB_PATH)
+    if not user_exists(username):
+        return False
+
+    conn = database.connect()
     cursor = conn.cursor()
 
     cursor.execute("SELECT password FROM auth WHERE username = ?", (username,))
@@ -211,8 +553,7 @@ def change_password(username: str, old_password: str, new_password: str) -> bool
 
     if row and verify_password(old_password, row[0]):
         new_hashed = hash_password(new_password)
-        cursor.execute("UPDATE auth SET password = ? WHERE username = ?", (new_hashed, username))
-        conn.commit()
+        cursor = database.execute_write(conn, "UPDATE auth SET password = ? WHERE username = ?", (new_hashed, username))
         updated = cursor.rowcount > 0
     else:
         updated = False
@@ -232,7 +573,10 @@ def reset_passwd(username: str, new_password: str) -> bool:
     Returns:
         bool: True if updated, False otherwise.
     """
-    conn = sqlite3.connect(DB_PATH)
+    if not user_exists(username):
+        return False
+
+    conn = database.connect()
     cursor = conn.cursor()
 
     cursor.execute("SELECT id FROM auth WHERE username = ?", (username,))
@@ -242,8 +586,7 @@ def reset_passwd(username: str, new_password: str) -> bool:
         return False
 
     new_hashed = hash_password(new_password)
-    cursor.execute("UPDATE auth SET password = ? WHERE username = ?", (new_hashed, username))
-    conn.commit()
+    cursor = database.execute_write(conn, "UPDATE auth SET password = ? WHERE username = ?", (new_hashed, username))
     updated = cursor.rowcount > 0
     conn.close()
     return updated
@@ -259,7 +602,10 @@ def get_user_details(username: str):
     Returns:
         dict or None: User details dict or None if not found.
     """
-    conn = sqlite3.connect(DB_PATH)
+    if not user_exists(username):
+        return None
+
+    conn = database.connect()
     cursor = conn.cursor()
 
     cursor.execute("SELECT id, username FROM auth WHERE username = ?", (username,))
@@ -0,0 +1,213 @@
+"""
+Microbenchmarks for the data-layer functions in auth.py and particles.py.
+
+Each function is timed directly (no HTTP) against a fresh in-memory database
+seeded at 1, 1k and 100k rows: that many particles for the benchmark user,
+and as many other users and sessions, so lookups in auth and sessions scale
+too. Password checks
+run at bcrypt cost BENCH_ROUNDS so login and edit_particle measure their SQL,
+not bcrypt; hash_password alone measures bcrypt, at HASH_ROUNDS. For every
+function the script reports ops/sec per size and the scaling exponent k in
+time ~ rows^k (0 = constant, 1 = linear) between the two largest sizes, and appends the run to a JSON
+history file. An exponent that jumps between runs (e.g. an index stops being
+used and a lookup becomes a full scan) is flagged.
+
+    python bench.py
+    python bench.py --sizes 1,1000 --min-time 0.2
+"""
+
+import argparse
+import json
+import math
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import auth
+import config
+import database
+import leaderboard
+import particles
+
+DEFAULT_SIZES = [1, 1_000, 100_000]
+HISTORY_PATH = config.BASE_DIR / "bench_history.json"
+EXPONENT_TOLERANCE = 0.5  # flag exponents that grew by more than this since the last run
+
+BENCH_ROUNDS = 4  # cheapest bcrypt cost, for the data-layer benchmarks
+HASH_ROUNDS = 12  # cost of the hash_password benchmark; fixed so runs stay comparable
+
+USERNAME = "benchuser"
+PASSWORD = "benchpass"
+
+
+def _content(n: int) -> str:
+    # Roughly 1% of particles match the search term
+    return f"Body of note {n}. " + ("needle " if n % 100 == 0 else "") + "lorem ipsum " * 20
+
+
+def seed(rows: int) -> dict:
+    """
+    Point the data layer at a new in-memory database holding the benchmark
+    user with `rows` particles, plus `rows` other users with a session each.
+
+    Args:
+        rows (int): Particles to create for the benchmark user, and other users and sessions.
+
+    Returns:
+        dict: Fixtures the benchmarks need (a particle ID, a session token).
+    """
+    # Benchmark the per-call cost of a write, not the group-commit window
+    settings = config.Config(in_memory=True, group_commit=False, bcrypt_rounds=BENCH_ROUNDS)
+    database.configure(settings)
+    database.init_db()
+    auth.configure_bcrypt(settings)
+    auth.add_new_user(USERNAME, PASSWORD)
+
+    conn = database.connect()
+    conn.executemany(
+        "INSERT INTO particles (username, title, content, preview, word_count, byte_size) VALUES (?, ?, ?, ?, ?, ?)",
+        ((USERNAME, f"Note {n}", _content(n), *particles.summarize(_content(n))) for n in range(rows)),
+    )
+    # Other users share one hash; only the size of auth and sessions matters here
+    hashed = auth.hash_password(PASSWORD)
+    conn.executemany("INSERT INTO auth (username, password) VALUES (?, ?)", ((f"user{n}", hashed) for n in range(rows)))
+    expiry = int(time.time()) + auth.SESSION_EXPIRY
+    conn.executemany(
+        "INSERT INTO sessions (user_id, token, expiry) SELECT id, ?, ? FROM auth WHERE username = ?",
+        ((auth.hash_token(f"token{n}"), expiry, f"user{n}") for n in range(rows)),
+    )
+    conn.commit()
+    particle_id = conn.execute("SELECT MAX(article_id) FROM particles").fetchone()[0]
+    conn.close()
+    auth.load_user_index()
+
+    return {"particle_id": particle_id, "token": auth.login(USERNAME, PASSWORD)}
+
+
+def benchmarks(fixtures: dict) -> dict:
+    """
+    Return the functions to time, as name -> zero-argument callable.
+    """
+    particle_id = fixtures["particle_id"]
+    return {
+        "login": lambda: auth.login(USERNAME, PASSWORD),
+        "validate_session": lambda: auth.validate_session(fixtures["token"]),
+        "hash_password": lambda: auth.hash_password(PASSWORD, rounds=HASH_ROUNDS),
+        "view_articles": lambda: particles.view_articles(USERNAME),
+        "search_article": lambda: particles.search_article(USERNAME, "needle"),
+        "create_article": lambda: particles.create_article(USERNAME, "New", "Fresh content"),
+        "edit_particle": lambda: particles.edit_particle(USERNAME, PASSWORD, particle_id, new_content="Edited content"),
+        "particle_views_count": lambda: particles.particle_views_count(particle_id),
+        "top_particles": lambda: leaderboard.top(limit=10, username=USERNAME),
+    }
+
+
+def measure(fn, min_time: float, min_runs: int = 3) -> float:
+    """
+    Call fn until both min_time seconds and min_runs calls have passed.
+
+    Returns:
+        float: Operations per second.
+    """
+    runs = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time or runs < min_runs:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - started
+    return runs / elapsed
+
+
+def exponent(sizes: list, ops: dict) -> float:
+    """
+    Fit k in time ~ rows^k between the two largest sizes, where fixed
+    per-call overhead matters least.
+    """
+    if len(sizes) < 2:
+        return 0.0
+    small, large = sizes[-2], sizes[-1]
+    return math.log(ops[small] / ops[large]) / math.log(large / small)
+
+
+def git_commit() -> str:
+    """
+    Return the short hash of the checked-out commit, if git is available.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=config.BASE_DIR
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(sizes: list, min_time: float) -> dict:
+    """
+    Time every benchmark at every size.
+
+    Returns:
+        dict: History entry for this run.
+    """
+    results = {}
+    for rows in sizes:
+        fixtures = seed(rows)
+        for name, fn in benchmarks(fixtures).items():
+            results.setdefault(name, {})[rows] = measure(fn, min_time)
+            print(f"{name:<22} {rows:>8} rows  {results[name][rows]:>12.1f} ops/s")
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sizes": sizes,
+        "ops_per_sec": {name: {str(rows): round(ops, 2) for rows, ops in by_size.items()} for name, by_size in results.items()},
+        "exponents": {name: round(exponent(sizes, by_size), 3) for name, by_size in results.items()},
+    }
+
+
+def compare(entry: dict, history: list) -> list:
+    """
+    Flag functions whose scaling exponent grew since the last run with the same sizes.
+
+    Returns:
+        list[str]: Warnings.
+    """
+    previous = next((old for old in reversed(history) if old["sizes"] == entry["sizes"]), None)
+    if not previous:
+        return []
+    warnings = []
+    for name, k in entry["exponents"].items():
+        old_k = previous["exponents"].get(name)
+        if old_k is not None and k - old_k > EXPONENT_TOLERANCE:
+            warnings.append(f"{name}: scaling exponent {old_k} -> {k} (since {previous['commit'] or previous['timestamp']})")
+    return warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated rows per user")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent per function and size")
+    parser.add_argument("--history", type=Path, default=HISTORY_PATH, help="JSON history file to append to")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    entry = run(sizes, args.min_time)
+
+    print("\nscaling exponent (time ~ rows^k):")
+    for name, k in entry["exponents"].items():
+        print(f"  {name:<22} k = {k:.2f}")
+
+    history = json.loads(args.history.read_text()) if args.history.exists() else []
+    warnings = compare(entry, history)
+    for warning in warnings:
+        print(f"WARNING {warning}")
+
+    history.append(entry)
+    args.history.write_text(json.dumps(history, indent=2) + "\n")
+    print(f"\nappended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
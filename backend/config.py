@@ -0,0 +1,115 @@
+"""
+This file holds the runtime configuration, read from environment variables
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+@dataclass
+class Config:
+    """
+    Settings shared by every worker process.
+
+    Attributes:
+        db_path (Path): Absolute path of the SQLite database file.
+        host (str): Interface to bind.
+        port (int): Port to bind.
+        workers (int): Number of uvicorn worker processes; serve.py defaults it to one per CPU.
+        busy_timeout_ms (int): How long a connection waits on a locked database.
+        write_retries (int): Extra attempts for a write that still hits a lock.
+        in_memory (bool): Use a private in-memory database (memdb VFS) instead of db_path.
+        snapshot_path (Optional[Path]): In-memory mode only; database file loaded at
+            startup (if it exists) and written back at shutdown.
+        blob_dir (Path): Directory of the content-addressed attachment store.
+        max_attachment_bytes (int): Largest accepted attachment upload.
+        group_commit (bool): Batch particle writes through a single writer thread.
+        group_commit_max_batch (int): Most writes committed together.
+        group_commit_window_ms (float): How long the writer keeps collecting a batch.
+        admin_key (Optional[str]): Secret for admin endpoints and on-demand profiling; admin features are off without it.
+        profile_sample_rate (float): Fraction of requests profiled without being asked to.
+        profile_dir (Path): Where request profiles are saved.
+        profile_keep (int): How many recent profiles are kept.
+        bcrypt_target_ms (float): Target password verify latency used to calibrate the bcrypt cost.
+        bcrypt_rounds (Optional[int]): Fixed bcrypt cost; skips calibration when set.
+        bcrypt_calibration (Optional[dict]): Calibration already done by serve.py, reused by every worker.
+        search_workers (int): Processes scanning particles for admin search, across all workers; 0 means one per CPU.
+        auth_ip_rate (float): Auth requests per second allowed per client IP, across all workers.
+        auth_ip_burst (int): Auth requests a client IP may send at once, across all workers.
+        auth_user_rate (float): Auth requests per second allowed per username, across all workers.
+        auth_user_burst (int): Auth requests a username may receive at once, across all workers.
+        auth_max_concurrent (int): bcrypt-backed requests in flight at once, across all workers;
+            0 means one per CPU. Each worker enforces its 1/workers share of these limits.
+    """
+
+    db_path: Path = field(default_factory=lambda: BASE_DIR / "db" / "pim.db")
+    host: str = "127.0.0.1"
+    port: int = 8000
+    workers: int = 1
+    busy_timeout_ms: int = 5000
+    write_retries: int = 5
+    in_memory: bool = False
+    snapshot_path: Optional[Path] = None
+    blob_dir: Path = field(default_factory=lambda: BASE_DIR / "db" / "blobs")
+    max_attachment_bytes: int = 50 * 1024 * 1024
+    group_commit: bool = True
+    group_commit_max_batch: int = 64
+    group_commit_window_ms: float = 2.0
+    admin_key: Optional[str] = None
+    profile_sample_rate: float = 0.0
+    profile_dir: Path = field(default_factory=lambda: BASE_DIR / "db" / "profiles")
+    profile_keep: int = 50
+    bcrypt_target_ms: float = 250.0
+    bcrypt_rounds: Optional[int] = None
+    bcrypt_calibration: Optional[dict] = None
+    search_workers: int = 0
+    auth_ip_rate: float = 1.0
+    auth_ip_burst: int = 10
+    auth_user_rate: float = 0.2
+    auth_user_burst: int = 5
+    auth_max_concurrent: int = 0
+
+
+def load_config() -> Config:
+    """
+    Build a Config from PIM_* environment variables, falling back to defaults.
+
+    Returns:
+        Config: The resolved configuration. db_path is always absolute.
+    """
+    defaults = Config()
+    return Config(
+        db_path=Path(os.environ.get("PIM_DB_PATH", defaults.db_path)).expanduser().resolve(),
+        host=os.environ.get("PIM_HOST", defaults.host),
+        port=int(os.environ.get("PIM_PORT", defaults.port)),
+        workers=int(os.environ.get("PIM_WORKERS", defaults.workers)),
+        busy_timeout_ms=int(os.environ.get("PIM_BUSY_TIMEOUT_MS", defaults.busy_timeout_ms)),
+        write_retries=int(os.environ.get("PIM_WRITE_RETRIES", defaults.write_retries)),
+        in_memory=os.environ.get("PIM_IN_MEMORY", "0") == "1",
+        snapshot_path=Path(os.environ["PIM_SNAPSHOT_PATH"]).expanduser().resolve()
+        if "PIM_SNAPSHOT_PATH" in os.environ
+        else None,
+        blob_dir=Path(os.environ.get("PIM_BLOB_DIR", defaults.blob_dir)).expanduser().resolve(),
+        max_attachment_bytes=int(os.environ.get("PIM_MAX_ATTACHMENT_BYTES", defaults.max_attachment_bytes)),
+        group_commit=os.environ.get("PIM_GROUP_COMMIT", "1") == "1",
+        group_commit_max_batch=int(os.environ.get("PIM_GROUP_COMMIT_MAX_BATCH", defaults.group_commit_max_batch)),
+        group_commit_window_ms=float(os.environ.get("PIM_GROUP_COMMIT_WINDOW_MS", defaults.group_commit_window_ms)),
+        admin_key=os.environ.get("PIM_ADMIN_KEY") or None,
+        profile_sample_rate=float(os.environ.get("PIM_PROFILE_SAMPLE_RATE", defaults.profile_sample_rate)),
+        profile_dir=Path(os.environ.get("PIM_PROFILE_DIR", defaults.profile_dir)).expanduser().resolve(),
+        profile_keep=int(os.environ.get("PIM_PROFILE_KEEP", defaults.profile_keep)),
+        bcrypt_target_ms=float(os.environ.get("PIM_BCRYPT_TARGET_MS", defaults.bcrypt_target_ms)),
+        bcrypt_rounds=int(os.environ["PIM_BCRYPT_ROUNDS"]) if os.environ.get("PIM_BCRYPT_ROUNDS") else None,
+        bcrypt_calibration=json.loads(os.environ["PIM_BCRYPT_CALIBRATION"]) if os.environ.get("PIM_BCRYPT_CALIBRATION") else None,
+        search_workers=int(os.environ.get("PIM_SEARCH_WORKERS", defaults.search_workers)),
+        auth_ip_rate=float(os.environ.get("PIM_AUTH_IP_RATE", defaults.auth_ip_rate)),
+        auth_ip_burst=int(os.environ.get("PIM_AUTH_IP_BURST", defaults.auth_ip_burst)),
+        auth_user_rate=float(os.environ.get("PIM_AUTH_USER_RATE", defaults.auth_user_rate)),
+        auth_user_burst=int(os.environ.get("PIM_AUTH_USER_BURST", defaults.auth_user_burst)),
+        auth_max_concurrent=int(os.environ.get("PIM_AUTH_MAX_CONCURRENT", defaults.auth_max_concurrent)),
+    )
@@ -0,0 +1,449 @@
+"""
+This file handles SQLite connections shared by auth.py and particles.py
+"""
+
+import random
+import re
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable
+
+import config
+
+RETRY_BASE_DELAY = 0.01  # seconds, doubled on every retry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS auth (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS particles (
+    article_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    FOREIGN KEY (username) REFERENCES auth(username)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    expiry INTEGER NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES auth(id)
+);
+-- validate_session looks sessions up by token on every authenticated request
+CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(token);
+CREATE TABLE IF NOT EXISTS cache_revisions (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+-- Registrations (added = 1) and deletions (added = 0), replayed by other workers' username indexes
+CREATE TABLE IF NOT EXISTS username_changes (
+    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    added INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    article_id INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    FOREIGN KEY (article_id) REFERENCES particles(article_id)
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_article ON attachments(article_id);
+CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments(sha256);
+CREATE TABLE IF NOT EXISTS particle_revisions (
+    article_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    kind TEXT NOT NULL,  -- 'snapshot' (body is the content) or 'delta' (body is a JSON delta)
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (article_id, version)
+);
+CREATE TABLE IF NOT EXISTS particle_view_buckets (
+    article_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,  -- hours since the epoch
+    views INTEGER NOT NULL,
+    PRIMARY KEY (article_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_view_buckets_bucket ON particle_view_buckets(bucket);
+CREATE TABLE IF NOT EXISTS particle_view_windows (
+    span TEXT NOT NULL,  -- '24h' or '7d'
+    article_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    views INTEGER NOT NULL,
+    PRIMARY KEY (span, article_id)
+);
+CREATE INDEX IF NOT EXISTS idx_view_windows_top ON particle_view_windows(span, views);
+CREATE INDEX IF NOT EXISTS idx_view_windows_user_top ON particle_view_windows(span, username, views);
+CREATE TABLE IF NOT EXISTS user_stats (
+    username TEXT PRIMARY KEY,
+    particle_count INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    total_words INTEGER NOT NULL DEFAULT 0,
+    last_modified INTEGER  -- unix time of the last create, edit or delete
+);
+CREATE TABLE IF NOT EXISTS view_window_state (
+    span TEXT PRIMARY KEY,
+    expired_through INTEGER NOT NULL  -- newest bucket already subtracted from the window
+);
+"""
+
+# Columns added after the original schema, as (table, column, declaration)
+COLUMNS = [
+    ("particles", "views", "INTEGER DEFAULT 0"),
+    ("particles", "preview", "TEXT"),
+    ("particles", "word_count", "INTEGER"),
+    ("particles", "byte_size", "INTEGER"),
+]
+
+# Indexes over migrated columns, created once COLUMNS exist
+INDEXES = """
+-- Covers the list query, so listing never reads the (possibly overflowing) content
+CREATE INDEX IF NOT EXISTS idx_particles_list
+    ON particles(username, article_id, title, preview, word_count, byte_size);
+-- Most-viewed rankings walk these from the top instead of sorting the table
+CREATE INDEX IF NOT EXISTS idx_particles_views ON particles(views);
+CREATE INDEX IF NOT EXISTS idx_particles_user_views ON particles(username, views);
+"""
+
+# Keep user_stats exact in the same transaction as every particle write (see stats.py)
+TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS user_stats_insert AFTER INSERT ON particles
+BEGIN
+    INSERT INTO user_stats (username, particle_count, total_bytes, total_words, last_modified)
+    VALUES (new.username, 1, COALESCE(new.byte_size, 0), COALESCE(new.word_count, 0), CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT(username) DO UPDATE SET
+        particle_count = particle_count + 1,
+        total_bytes = total_bytes + excluded.total_bytes,
+        total_words = total_words + excluded.total_words,
+        last_modified = excluded.last_modified;
+END;
+CREATE TRIGGER IF NOT EXISTS user_stats_delete AFTER DELETE ON particles
+BEGIN
+    UPDATE user_stats SET
+        particle_count = particle_count - 1,
+        total_bytes = total_bytes - COALESCE(old.byte_size, 0),
+        total_words = total_words - COALESCE(old.word_count, 0),
+        last_modified = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE username = old.username;
+END;
+-- Backfilling byte_size/word_count adjusts the totals but is not a modification
+CREATE TRIGGER IF NOT EXISTS user_stats_update AFTER UPDATE OF username, title, content, byte_size, word_count ON particles
+BEGIN
+    UPDATE user_stats SET
+        particle_count = particle_count - 1,
+        total_bytes = total_bytes - COALESCE(old.byte_size, 0),
+        total_words = total_words - COALESCE(old.word_count, 0)
+    WHERE username = old.username;
+    INSERT INTO user_stats (username, particle_count, total_bytes, total_words)
+    VALUES (new.username, 1, COALESCE(new.byte_size, 0), COALESCE(new.word_count, 0))
+    ON CONFLICT(username) DO UPDATE SET
+        particle_count = particle_count + 1,
+        total_bytes = total_bytes + excluded.total_bytes,
+        total_words = total_words + excluded.total_words;
+    UPDATE user_stats SET last_modified = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE username = new.username AND (old.title IS NOT new.title OR old.content IS NOT new.content OR old.username IS NOT new.username);
+END;
+"""
+
+# Set to a list while a request is profiled; connections opened meanwhile append their SQL to it
+statement_log = ContextVar("pim_statement_log", default=None)
+
+# Statements on these tables carry password hashes and session tokens; their values are never logged
+_SECRET_TABLES = re.compile(r"\b(?:from|into|update|join)\s+(?:auth|sessions)\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'|[xX]'[0-9A-Fa-f]*'")
+
+_config = config.load_config()
+_target = _config.db_path.as_uri()
+_anchor = None  # keeps an in-memory database alive between connections
+
+
+def configure(cfg: config.Config) -> None:
+    """
+    Point every subsequent connection at the database described by cfg.
+
+    In in-memory mode every call creates a fresh, empty database, so apps built
+    one after another (e.g. by tests) never see each other's data.
+
+    Args:
+        cfg (config.Config): Configuration to use.
+    """
+    global _config, _target, _anchor
+    if _anchor is not None:
+        _anchor.close()
+        _anchor = None
+
+    _config = cfg
+    if cfg.in_memory:
+        # The memdb VFS locks like a file database (readers and writers wait out the busy
+        # timeout), unlike cache=shared, whose table locks fail at once under concurrency
+        _target = f"file:/pim-{uuid.uuid4().hex}?vfs=memdb"
+        # A memdb database lives as long as one connection to it is open
+        _anchor = sqlite3.connect(_target, uri=True, check_same_thread=False)
+        if cfg.snapshot_path and Path(cfg.snapshot_path).exists():
+            load_snapshot(cfg.snapshot_path)
+    else:
+        _target = Path(cfg.db_path).resolve().as_uri()
+
+
+@contextmanager
+def preserved():
+    """
+    Keep the configured database through a block that calls configure(), then
+    switch back to it. An in-memory database keeps its contents, because its
+    anchor connection is set aside instead of closed.
+
+    Caches keyed on settings() (writer queue, username index) notice the
+    switch and rebuild themselves.
+    """
+    global _config, _target, _anchor
+    saved = (_config, _target, _anchor)
+    _anchor = None
+    try:
+        yield
+    finally:
+        if _anchor is not None:
+            _anchor.close()
+        _config, _target, _anchor = saved
+
+
+def settings() -> config.Config:
+    """
+    Return the configuration connections are currently made with.
+
+    Returns:
+        config.Config: Active configuration.
+    """
+    return _config
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Open a connection to the configured database.
+
+    The busy timeout makes a connection wait for other processes' write locks
+    instead of failing straight away.
+
+    Returns:
+        sqlite3.Connection: A new connection.
+    """
+    conn = sqlite3.connect(_target, uri=True, timeout=_config.busy_timeout_ms / 1000)
+    # WAL only needs an fsync at checkpoints, so NORMAL is still durable against app crashes
+    conn.execute("PRAGMA synchronous = NORMAL")
+    log = statement_log.get()
+    if log is not None:
+        conn.set_trace_callback(trace_callback(log))
+    return conn
+
+
+def trace_callback(log: list) -> Callable[[str], None]:
+    """
+    Build a trace callback that appends executed statements to log, with
+    string values on the auth and sessions tables replaced by '?'.
+
+    Args:
+        log (list): Statement log of a profiled request.
+
+    Returns:
+        Callable[[str], None]: Callback for sqlite3.Connection.set_trace_callback.
+    """
+    def record(statement: str) -> None:
+        if _SECRET_TABLES.search(statement):
+            statement = _STRING_LITERAL.sub("?", statement)
+        log.append(statement)
+    return record
+
+
+def read_only_uri() -> str:
+    """
+    Return a URI that opens the configured database read-only, for
+    connections made outside this module (e.g. in other processes).
+
+    In-memory databases can't be opened read-only through a URI; their
+    memdb URI is returned as is, and only works in this process.
+
+    Returns:
+        str: SQLite URI, to be opened with uri=True.
+    """
+    if _config.in_memory:
+        return _target
+    return f"{_target}?mode=ro"
+
+
+def is_locked(error: sqlite3.OperationalError) -> bool:
+    """
+    Check whether an OperationalError is a lock/busy error worth retrying.
+
+    Args:
+        error (sqlite3.OperationalError): The raised error.
+
+    Returns:
+        bool: True if the database was locked or busy.
+    """
+    message = str(error)
+    return any(text in message for text in ("database is locked", "database is busy"))
+
+
+def execute_transaction(conn: sqlite3.Connection, work: Callable[[sqlite3.Connection], Any]) -> Any:
+    """
+    Run work(conn) as one write transaction and commit it, retrying the whole
+    transaction with backoff while the database is locked by another process.
+
+    The transaction starts with BEGIN IMMEDIATE, so work that reads before it
+    writes holds the write lock throughout and can't deadlock on an upgrade.
+
+    Args:
+        conn (sqlite3.Connection): Connection to write through.
+        work (Callable[[sqlite3.Connection], Any]): Statements to run; may run more than once.
+
+    Returns:
+        Any: Whatever work returned.
+
+    Raises:
+        sqlite3.OperationalError: If the lock outlives every retry, or on any other error.
+    """
+    delay = RETRY_BASE_DELAY
+    for attempt in range(_config.write_retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not is_locked(e) or attempt == _config.write_retries:
+                raise
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def execute_write(conn: sqlite3.Connection, query: str, params: tuple = ()) -> sqlite3.Cursor:
+    """
+    Execute one write statement and commit it, retrying with backoff while the
+    database is locked by another process.
+
+    Args:
+        conn (sqlite3.Connection): Connection to write through.
+        query (str): SQL statement.
+        params (tuple): Statement parameters.
+
+    Returns:
+        sqlite3.Cursor: The cursor the statement ran on (rowcount, lastrowid).
+
+    Raises:
+        sqlite3.OperationalError: If the lock outlives every retry, or on any other error.
+    """
+    return execute_transaction(conn, lambda c: c.execute(query, params))
+
+
+def get_revision(name: str) -> int:
+    """
+    Return the current revision of a named piece of cached state.
+
+    Worker processes keep their own in-memory caches; each cache remembers the
+    revision it was built at and rebuilds itself when this value moves.
+
+    Args:
+        name (str): Cache name.
+
+    Returns:
+        int: Revision number, 0 if it was never bumped.
+    """
+    conn = connect()
+    row = conn.execute("SELECT revision FROM cache_revisions WHERE name = ?", (name,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def bump_revision(conn: sqlite3.Connection, name: str) -> None:
+    """
+    Invalidate a named cache in every worker. Runs inside the caller's
+    transaction, so it commits together with the change it describes.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        name (str): Cache name.
+    """
+    conn.execute(
+        "INSERT INTO cache_revisions (name, revision) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET revision = revision + 1",
+        (name,),
+    )
+
+
+def load_snapshot(path: Path) -> None:
+    """
+    Replace the in-memory database with the contents of a database file.
+
+    Args:
+        path (Path): SQLite file to load.
+    """
+    source = sqlite3.connect(path)
+    source.backup(_anchor)
+    source.close()
+
+
+def save_snapshot(path: Path) -> None:
+    """
+    Write the in-memory database out to a database file.
+
+    Args:
+        path (Path): Destination SQLite file, overwritten if it exists.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    dest = sqlite3.connect(path)
+    _anchor.backup(dest)
+    dest.close()
+
+
+def init_db() -> None:
+    """
+    One-off database setup: schema bootstrap, WAL mode and columns that used
+    to be added lazily. Safe to run from several processes.
+    """
+    conn = connect()
+    if not _config.in_memory:
+        # WAL lets readers in every worker proceed while one process writes
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    for table, column, declaration in COLUMNS:
+        _add_column(conn, table, column, declaration)
+    conn.executescript(INDEXES)
+    conn.executescript(TRIGGERS)
+    conn.commit()
+    conn.close()
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
+    """
+    Add a column to a table unless it is already there.
+
+    Args:
+        conn (sqlite3.Connection): Open connection.
+        table (str): Table name.
+        column (str): Column name.
+        declaration (str): Type and constraints.
+    """
+    columns = [col[1] for col in conn.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    except sqlite3.OperationalError as e:
+        # Another worker added it first
+        if "duplicate column" not in str(e):
+            raise
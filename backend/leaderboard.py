@@ -0,0 +1,158 @@
+"""
+This file keeps the most-viewed particle rankings.
+
+All-time rankings read particles.views through an index, so the top N is an
+index walk of N rows. Windowed rankings (last 24h / 7d) use hourly buckets:
+every view bumps its particle's counter for the current hour and a running
+total per window in particle_view_windows, which is indexed by that total.
+When an hour leaves a window its bucket is subtracted from the window totals
+once, so serving a trending list never sums buckets.
+
+Windows move in whole hours: "24h" means the current hour plus the 23 before it.
+"""
+
+import sqlite3
+import time
+from typing import Optional
+
+import database
+
+BUCKET_SECONDS = 3600
+WINDOWS = {"24h": 24, "7d": 24 * 7}  # window name -> buckets it spans
+ALL_TIME = "all"
+
+# (settings, hour bucket) this process last brought the window totals up to; the database keeps the real state
+_expired = (None, None)
+
+
+def _bucket(now: Optional[float]) -> int:
+    """
+    Return the hour bucket a timestamp falls into.
+    """
+    return int((time.time() if now is None else now) // BUCKET_SECONDS)
+
+
+def _expiry_due(current: int) -> bool:
+    """
+    Check whether this process has yet to run expire() for this hour on the configured database.
+    """
+    settings, bucket = _expired
+    return settings is not database.settings() or bucket != current
+
+
+def expire(conn: sqlite3.Connection, now: Optional[float] = None) -> None:
+    """
+    Subtract buckets that left each window from its totals and drop buckets
+    no window needs any more. Runs inside the caller's write transaction.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        now (Optional[float]): Current time, defaults to time.time().
+    """
+    global _expired
+    current = _bucket(now)
+    if not _expiry_due(current):
+        return
+
+    for span, buckets in WINDOWS.items():
+        cutoff = current - buckets  # newest bucket outside the window
+        row = conn.execute("SELECT expired_through FROM view_window_state WHERE span = ?", (span,)).fetchone()
+        done = row[0] if row else -1
+        if done >= cutoff:
+            continue
+        conn.execute(
+            """
+            UPDATE particle_view_windows SET views = views - (
+                SELECT SUM(b.views) FROM particle_view_buckets b
+                WHERE b.article_id = particle_view_windows.article_id AND b.bucket > ? AND b.bucket <= ?
+            )
+            WHERE span = ? AND article_id IN (
+                SELECT article_id FROM particle_view_buckets WHERE bucket > ? AND bucket <= ?
+            )
+            """,
+            (done, cutoff, span, done, cutoff),
+        )
+        conn.execute("DELETE FROM particle_view_windows WHERE span = ? AND views <= 0", (span,))
+        conn.execute(
+            "INSERT INTO view_window_state (span, expired_through) VALUES (?, ?) "
+            "ON CONFLICT(span) DO UPDATE SET expired_through = excluded.expired_through",
+            (span, cutoff),
+        )
+
+    conn.execute("DELETE FROM particle_view_buckets WHERE bucket <= ?", (current - max(WINDOWS.values()),))
+    _expired = (database.settings(), current)
+
+
+def record_view(conn: sqlite3.Connection, article_id: int, now: Optional[float] = None) -> None:
+    """
+    Count one view of a particle in the windowed rankings. Runs inside the
+    caller's write transaction, next to the particles.views update.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        article_id (int): Particle ID.
+        now (Optional[float]): Time of the view, defaults to time.time().
+    """
+    expire(conn, now)
+    conn.execute(
+        "INSERT INTO particle_view_buckets (article_id, bucket, views) VALUES (?, ?, 1) "
+        "ON CONFLICT(article_id, bucket) DO UPDATE SET views = views + 1",
+        (article_id, _bucket(now)),
+    )
+    for span in WINDOWS:
+        conn.execute(
+            "INSERT INTO particle_view_windows (span, article_id, username, views) "
+            "SELECT ?, article_id, username, 1 FROM particles WHERE article_id = ? "
+            "ON CONFLICT(span, article_id) DO UPDATE SET views = views + 1",
+            (span, article_id),
+        )
+
+
+def top(limit: int = 10, username: Optional[str] = None, window: str = ALL_TIME, now: Optional[float] = None):
+    """
+    Return the most viewed particles, globally or for one user.
+
+    Args:
+        limit (int): Number of particles to return.
+        username (Optional[str]): Only rank this user's particles.
+        window (str): "all", or a key of WINDOWS.
+        now (Optional[float]): Current time, defaults to time.time().
+
+    Returns:
+        list[dict]: Particles with their view counts, most viewed first.
+    """
+    conn = database.connect()
+    if window == ALL_TIME:
+        query = "SELECT article_id, username, title, COALESCE(views, 0) FROM particles"
+        params = ()
+        if username is not None:
+            query += " WHERE username = ?"
+            params = (username,)
+        rows = conn.execute(query + " ORDER BY views DESC LIMIT ?", (*params, limit)).fetchall()
+    else:
+        if _expiry_due(_bucket(now)):
+            database.execute_transaction(conn, lambda c: expire(c, now))
+        query = (
+            "SELECT w.article_id, w.username, p.title, w.views FROM particle_view_windows w "
+            "JOIN particles p ON p.article_id = w.article_id WHERE w.span = ?"
+        )
+        params = (window,)
+        if username is not None:
+            query += " AND w.username = ?"
+            params += (username,)
+        rows = conn.execute(query + " ORDER BY w.views DESC LIMIT ?", (*params, limit)).fetchall()
+    conn.close()
+
+    return [{"particle_id": row[0], "username": row[1], "title": row[2], "views": row[3]} for row in rows]
+
+
+def delete_for_article(conn: sqlite3.Connection, article_id: int) -> None:
+    """
+    Drop a particle's view counters, inside the caller's transaction.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        article_id (int): Particle ID.
+    """
+    conn.execute("DELETE FROM particle_view_buckets WHERE article_id = ?", (article_id,))
+    conn.execute("DELETE FROM particle_view_windows WHERE article_id = ?", (article_id,))
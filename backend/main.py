@@ -1,33 +1,66 @@
-from fastapi import FastAPI, HTTPException, Query
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from pathlib import Path
+from typing import Optional
+import json
 import os
+import secrets
 import sys
 import uvicorn
 
-# Ensure relative SQLite paths in auth.py and particles.py resolve correctly
+# Make the sibling modules importable however the server is launched
 BASE_DIR = Path(__file__).resolve().parent
 if str(BASE_DIR) not in sys.path:
     sys.path.append(str(BASE_DIR))
-os.chdir(BASE_DIR)
 
 # Importing py files with the funcitons
+import attachments
 import auth 
+import config
+import database
+import leaderboard
 import particles 
+import profiling
+import ratelimit
+import revisions
+import search
+import stats
+import writer
 
 
-app = FastAPI(title="PIM API", version="1.0.0")
+router = APIRouter(route_class=profiling.ProfiledRoute)
+
+
+def rate_limited_handler(request: Request, exc: ratelimit.RateLimited):
+    """
+    Turn a shed request into a 429 with a Retry-After hint.
+    """
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Too many requests"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+def is_admin(request: Request) -> bool:
+    """
+    Check the X-Admin-Key header against the configured admin key.
+    """
+    key = request.app.state.settings.admin_key
+    supplied = request.headers.get("x-admin-key", "")
+    return bool(key) and secrets.compare_digest(supplied.encode(), key.encode())
+
+
+def client_ip(request: Request) -> str:
+    """
+    Return the client IP used to key the per-IP limiter.
+    """
+    return request.client.host if request.client else "unknown"
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
 # Payload data structures
 class Credentials(BaseModel):
@@ -47,7 +80,7 @@ class ArticleCreate(BaseModel):
     content: str
 
 
-@app.get("/health")
+@router.get("/health")
 def health_check():
     """
     Health check endpoint.
@@ -59,8 +92,8 @@ def health_check():
 
 
 # Auth endpoints
-@app.post("/auth/login")
-def login_user(payload: Credentials):
+@router.post("/auth/login")
+def login_user(payload: Credentials, request: Request):
     """
     Login endpoint.
 
@@ -71,13 +104,14 @@ def login_user(payload: Credentials):
         JSONResponse: Success or error message.
     """
 
-    token = auth.login(payload.username, payload.password)
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        token = auth.login(payload.username, payload.password)
     if not token:
         return JSONResponse(status_code=401, content={"error": "Invalid username or password"})
     return JSONResponse(content={"message": "Login successful", "token": token})
 
-@app.post("/auth/register", status_code=201)
-def register_user(payload: Credentials):
+@router.post("/auth/register", status_code=201)
+def register_user(payload: Credentials, request: Request):
     """
     Register new user.
 
@@ -88,14 +122,15 @@ def register_user(payload: Credentials):
         JSONResponse: Success or error message.
     """
 
-    created = auth.add_new_user(payload.username, payload.password)
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        created = auth.add_new_user(payload.username, payload.password)
     if not created:
         return JSONResponse(status_code=409, content={"error": "Username already exists"})
     return JSONResponse(content={"message": "User created"})
 
 
-@app.delete("/auth/delete")
-def delete_user(payload: Credentials):
+@router.delete("/auth/delete")
+def delete_user(payload: Credentials, request: Request):
     """
     Delete user.
 
@@ -106,14 +141,15 @@ def delete_user(payload: Credentials):
         JSONResponse: Success or error message.
     """
 
-    deleted = auth.delete_user(payload.username, payload.password)
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        deleted = auth.delete_user(payload.username, payload.password)
     if not deleted:
         return JSONResponse(status_code=404, content={"error": "User not found or password incorrect"})
     return JSONResponse(content={"message": "User deleted"})
 
 
-@app.post("/auth/reset-password")
-def change_password(payload: ResetPasswordRequest):
+@router.post("/auth/reset-password")
+def change_password(payload: ResetPasswordRequest, request: Request):
 
     """
     Reset password.
@@ -125,13 +161,14 @@ def change_password(payload: ResetPasswordRequest):
         JSONResponse: Success or error message.
     """
 
-    updated = auth.reset_passwd(payload.username, payload.new_password)
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        updated = auth.reset_passwd(payload.username, payload.new_password)
     if not updated:
         return JSONResponse(status_code=404, content={"error": "User not found"})
     return JSONResponse(content={"message": "Password updated"})
 
 
-@app.get("/auth/user/{username}")
+@router.get("/auth/user/{username}")
 def get_user(username: str):
 
     """
@@ -151,8 +188,8 @@ def get_user(username: str):
 
 
 # Particle endpoints
-@app.post("/particles/create")
-def create_article(payload: ArticleCreate):
+@router.post("/particles/create")
+def create_article(payload: ArticleCreate, request: Request):
 
     """
     Create a new article.
@@ -165,7 +202,9 @@ def create_article(payload: ArticleCreate):
     """
 
     # Authenticate user first
-    if not auth.login(payload.username, payload.password):
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        token = auth.login(payload.username, payload.password)
+    if not token:
         return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
     
     # Create the article
@@ -176,41 +215,92 @@ def create_article(payload: ArticleCreate):
         return JSONResponse(status_code=500, content={"error": "Failed to create article"})
 
 
-@app.get("/particles/{username}")
-def list_articles(username: str):
+# Registered before /particles/{username}, which would otherwise match "top"
+@router.get("/particles/top")
+def top_articles(
+    limit: int = Query(10, ge=1, le=100, description="Number of particles"),
+    username: Optional[str] = Query(None, description="Only rank this user's particles"),
+    window: str = Query(leaderboard.ALL_TIME, description="all, 24h or 7d"),
+):
+    """
+    List the most viewed articles, all time or within a recent window.
+
+    Args:
+        limit (int): Number of articles.
+        username (str, optional): Only rank this user's articles.
+        window (str): "all", "24h" or "7d".
+
+    Returns:
+        JSONResponse: Articles with their view counts, most viewed first.
+    """
+
+    if window != leaderboard.ALL_TIME and window not in leaderboard.WINDOWS:
+        return JSONResponse(status_code=400, content={"error": "window must be one of: all, " + ", ".join(leaderboard.WINDOWS)})
+    items = leaderboard.top(limit, username, window)
+    return JSONResponse(content={"items": items, "count": len(items), "window": window})
+
+
+@router.get("/particles/{username}")
+def list_articles(username: str, full: bool = Query(False, description="Include full content")):
     """
-    List all articles for a user.
+    List all articles for a user. Items carry a preview unless full is set.
 
     Args:
         username (str): Username.
+        full (bool): Include full content.
 
     Returns:
         JSONResponse: List of articles.
     """
 
-    items = particles.view_articles(username)
+    items = particles.view_articles(username, full=full)
     return JSONResponse(content={"items": items, "count": len(items)})
 
 
-@app.get("/particles/{username}/search")
-def search_articles(username: str, q: str = Query(..., min_length=1, description="Search query")):
+@router.get("/particles/{username}/search")
+def search_articles(
+    username: str,
+    q: str = Query(..., min_length=1, description="Search query"),
+    full: bool = Query(False, description="Include full content")
+):
     
     """
-    Search articles for a user.
+    Search articles for a user. Items carry a preview unless full is set.
 
     Args:
         username (str): Username.
         q (str): Search query.
+        full (bool): Include full content.
 
     Returns:
         JSONResponse: List of matching articles.
     """
 
-    items = particles.search_article(username, q)
+    items = particles.search_article(username, q, full=full)
     return JSONResponse(content={"items": items, "count": len(items)})
 
 
-@app.delete("/particles/{article_id}")
+@router.get("/particles/{username}/stats")
+def user_stats(username: str):
+    """
+    Get totals over a user's articles.
+
+    Args:
+        username (str): Username.
+
+    Returns:
+        JSONResponse: Article count, bytes, words and last modification time.
+    """
+
+    item = stats.get_stats(username)
+    if item is None:
+        if not auth.user_exists(username):
+            return JSONResponse(status_code=404, content={"error": "User not found"})
+        item = {"username": username, "particle_count": 0, "total_bytes": 0, "total_words": 0, "last_modified": None}
+    return JSONResponse(content=item)
+
+
+@router.delete("/particles/{article_id}")
 def delete_article(article_id: str):
 
     """
@@ -228,10 +318,11 @@ def delete_article(article_id: str):
         return JSONResponse(status_code=404, content={"error": "Article not found"})
     return JSONResponse(content={"message": "Article deleted"})
 
-@app.put("/particles/{article_id}/edit")
+@router.put("/particles/{article_id}/edit")
 def edit_article(
     article_id: str,
     payload: Credentials,
+    request: Request,
     new_title: str = None,
     new_content: str = None
 ):
@@ -249,25 +340,30 @@ def edit_article(
         JSONResponse: Success or error message.
     """
 
-    updated = particles.edit_particle(
-        username=payload.username,
-        password=payload.password,
-        particle_id=article_id,
-        new_title=new_title,
-        new_content=new_content
-    )
+    # edit_particle checks the password with bcrypt
+    with request.app.state.auth_admission.admit(client_ip(request), payload.username):
+        updated = particles.edit_particle(
+            username=payload.username,
+            password=payload.password,
+            particle_id=article_id,
+            new_title=new_title,
+            new_content=new_content
+        )
     if not updated:
         return JSONResponse(status_code=403, content={"error": "Edit failed. Check credentials or no changes provided."})
     return JSONResponse(content={"message": "Article updated"})
 
 
-@app.get("/particles/{article_id}")
-def get_article(article_id: str):
+# GET /particles/{article_id} would never be reached: /particles/{username} matches first
+@router.get("/particles/{article_id}/view")
+def get_article(article_id: str, count_view: bool = Query(False, description="Count this fetch as a view")):
     """
-    Get article by ID.
+    Get article by ID, including its full content. Fetching only counts as
+    a view when count_view is set, so e.g. opening the edit dialog doesn't.
 
     Args:
         article_id (str): Article ID.
+        count_view (bool): Count a view and return the new total.
 
     Returns:
         JSONResponse: Article details or error.
@@ -276,166 +372,327 @@ def get_article(article_id: str):
     item = particles.get_article_by_id(article_id)
     if not item:
         return JSONResponse(status_code=404, content={"error": "Article not found"})
+    if count_view:
+        item["views"] = particles.particle_views_count(article_id)
     return JSONResponse(content=item)
 
 
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from pathlib import Path
-import os
-import sys
-import uvicorn
+@router.get("/particles/{article_id}/revisions")
+def list_revisions(article_id: int):
+    """
+    List the stored revisions of an article, newest first.
 
-# Ensure relative SQLite paths in auth.py and particles.py resolve correctly
-BASE_DIR = Path(__file__).resolve().parent
-if str(BASE_DIR) not in sys.path:
-    sys.path.append(str(BASE_DIR))
-os.chdir(BASE_DIR)
+    Args:
+        article_id (int): Article ID.
 
-# Importing py files with the funcitons
-import auth 
-import particles 
+    Returns:
+        JSONResponse: List of revisions (without content).
+    """
 
+    items = revisions.list_revisions(article_id)
+    if not items:
+        return JSONResponse(status_code=404, content={"error": "No revisions for this article"})
+    return JSONResponse(content={"items": items, "count": len(items)})
 
-app = FastAPI(title="PIM API", version="1.0.0")
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@router.get("/particles/{article_id}/revisions/{version}")
+def get_revision(article_id: int, version: int):
+    """
+    Get an article as it was at one revision.
 
-# Payload data structures
-class Credentials(BaseModel):
-    username: str
-    password: str
+    Args:
+        article_id (int): Article ID.
+        version (int): Revision number.
 
+    Returns:
+        JSONResponse: Title and content at that revision, or error.
+    """
 
-class ResetPasswordRequest(BaseModel):
-    username: str
-    new_password: str
+    item = revisions.get_version(article_id, version)
+    if not item:
+        return JSONResponse(status_code=404, content={"error": "Revision not found"})
+    return JSONResponse(content=item)
 
 
-class ArticleCreate(BaseModel):
-    username: str
-    password: str
-    title: str
-    content: str
+# Attachment endpoints
+def bearer_token(request: Request) -> Optional[str]:
+    """
+    Return the session token from an "Authorization: Bearer <token>" header.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
 
 
-@app.get("/health")
-def health_check():
-    return JSONResponse(content={"status": "ok"})
+async def session_owns_article(request: Request, article_id: int) -> bool:
+    """
+    Check that the request carries a session of the particle's owner.
+    """
+    token = bearer_token(request)
+    if not token:
+        return False
+    username = await run_in_threadpool(auth.session_username, token)
+    owner = await run_in_threadpool(particles.get_article_owner, article_id)
+    return username is not None and username == owner
 
 
-# Auth endpoints
-@app.post("/auth/login")
-def login_user(payload: Credentials):
-    is_valid = auth.login(payload.username, payload.password)
-    if not is_valid:
-        return JSONResponse(status_code=401, content={"error": "Invalid username or password"})
-    return JSONResponse(content={"message": "Login successful"})
+@router.post("/particles/{article_id}/attachments")
+async def upload_attachment(
+    article_id: int,
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255, description="Original filename")
+):
+    """
+    Attach a file to an article. The request body is the raw file content and
+    is streamed to disk, so uploads are never held in memory.
 
+    Args:
+        article_id (int): Article ID.
+        filename (str): Original filename.
 
-@app.post("/auth/register", status_code=201)
-def register_user(payload: Credentials):
-    created = auth.add_new_user(payload.username, payload.password)
-    if not created:
-        return JSONResponse(status_code=409, content={"error": "Username already exists"})
-    return JSONResponse(content={"message": "User created"})
+    Returns:
+        JSONResponse: Attachment metadata or error.
+    """
 
+    if not await session_owns_article(request, article_id):
+        return JSONResponse(status_code=403, content={"error": "Login as the article owner to attach files"})
 
-@app.delete("/auth/delete")
-def delete_user(payload: Credentials):
-    deleted = auth.delete_user(payload.username, payload.password)
-    if not deleted:
-        return JSONResponse(status_code=404, content={"error": "User not found or password incorrect"})
-    return JSONResponse(content={"message": "User deleted"})
+    try:
+        sha256, size, staged = await attachments.store_blob(request.stream())
+    except attachments.AttachmentTooLarge:
+        return JSONResponse(status_code=413, content={"error": "Attachment too large"})
 
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    attachment_id = await run_in_threadpool(
+        attachments.add_attachment, article_id, sha256, size, filename, content_type, staged
+    )
+    return JSONResponse(
+        status_code=201,
+        content={"message": "Attachment added", "attachment_id": attachment_id, "sha256": sha256, "size": size},
+    )
 
-@app.post("/auth/reset-password")
-def change_password(payload: ResetPasswordRequest):
-    updated = auth.reset_passwd(payload.username, payload.new_password)
-    if not updated:
-        return JSONResponse(status_code=404, content={"error": "User not found"})
-    return JSONResponse(content={"message": "Password updated"})
 
+@router.get("/particles/{article_id}/attachments")
+def list_attachments(article_id: int):
+    """
+    List the attachments of an article.
 
-@app.get("/auth/user/{username}")
-def get_user(username: str):
-    user = auth.get_user_details(username)
-    if not user:
-        return JSONResponse(status_code=404, content={"error": "User not found"})
-    return JSONResponse(content=user)
+    Args:
+        article_id (int): Article ID.
 
+    Returns:
+        JSONResponse: List of attachments.
+    """
 
-# Particle endpoints
-@app.post("/particles/create")
-def create_article(payload: ArticleCreate):
-    # Authenticate user first
-    if not auth.login(payload.username, payload.password):
-        return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
-    
-    # Create the article
-    article_id = particles.create_article(payload.username, payload.title, payload.content)
-    if article_id:
-        return JSONResponse(content={"message": "Article created", "article_id": article_id})
-    else:
-        return JSONResponse(status_code=500, content={"error": "Failed to create article"})
+    items = attachments.list_attachments(article_id)
+    return JSONResponse(content={"items": items, "count": len(items)})
 
 
-@app.get("/particles/{username}")
-def list_articles(username: str):
-    items = particles.view_articles(username)
-    return JSONResponse(content={"items": items, "count": len(items)})
+@router.get("/attachments/{attachment_id}")
+def download_attachment(attachment_id: int):
+    """
+    Download an attachment. Served straight from disk (sendfile where
+    available) with HTTP Range support.
+
+    Args:
+        attachment_id (int): Attachment ID.
+
+    Returns:
+        FileResponse: File content, or JSONResponse error.
+    """
 
+    item = attachments.get_attachment(attachment_id)
+    if not item or not item["path"].exists():
+        return JSONResponse(status_code=404, content={"error": "Attachment not found"})
+    return FileResponse(
+        item["path"],
+        media_type=item["content_type"],
+        filename=item["filename"],
+        # Blobs are content addressed, so the digest is a perfect validator
+        headers={"ETag": f'"{item["sha256"]}"', "Cache-Control": "private, max-age=31536000, immutable"},
+    )
+
+
+@router.delete("/attachments/{attachment_id}")
+async def delete_attachment(attachment_id: int, request: Request):
+    """
+    Delete an attachment.
+
+    Args:
+        attachment_id (int): Attachment ID.
+
+    Returns:
+        JSONResponse: Success or error message.
+    """
+
+    item = await run_in_threadpool(attachments.get_attachment, attachment_id)
+    if not item:
+        return JSONResponse(status_code=404, content={"error": "Attachment not found"})
+    if not await session_owns_article(request, item["article_id"]):
+        return JSONResponse(status_code=403, content={"error": "Login as the article owner to delete files"})
+
+    await run_in_threadpool(attachments.delete_attachment, attachment_id)
+    return JSONResponse(content={"message": "Attachment deleted"})
 
-@app.get("/particles/{username}/search")
-def search_articles(username: str, q: str = Query(..., min_length=1, description="Search query")):
-    items = particles.search_article(username, q)
+
+# Admin endpoints
+@router.get("/admin/profiles")
+def list_profiles(request: Request):
+    """
+    List recently saved request profiles, newest first.
+
+    Returns:
+        JSONResponse: Profile metadata or error.
+    """
+
+    if not is_admin(request):
+        return JSONResponse(status_code=403, content={"error": "Admin key required"})
+    items = profiling.list_profiles(request.app.state.settings)
     return JSONResponse(content={"items": items, "count": len(items)})
 
 
-@app.delete("/particles/{article_id}")
-def delete_article(article_id: str):
-    ok = particles.delete_article(article_id)
-    if not ok:
-        return JSONResponse(status_code=404, content={"error": "Article not found"})
-    return JSONResponse(content={"message": "Article deleted"})
+@router.get("/admin/profiles/{profile_id}")
+def download_profile(profile_id: str, request: Request, metadata: bool = Query(False, description="Return the JSON metadata (incl. SQL) instead")):
+    """
+    Download a saved profile as a pstats file, or its metadata.
 
-@app.put("/particles/{article_id}/edit")
-def edit_article(
-    article_id: str,
-    payload: Credentials,
-    new_title: str = None,
-    new_content: str = None
+    Args:
+        profile_id (str): Profile ID.
+        metadata (bool): Return route, timing and SQL log instead of the pstats file.
+
+    Returns:
+        FileResponse: Profile file, or JSONResponse error.
+    """
+
+    if not is_admin(request):
+        return JSONResponse(status_code=403, content={"error": "Admin key required"})
+    files = profiling.profile_files(request.app.state.settings, profile_id)
+    if not files:
+        return JSONResponse(status_code=404, content={"error": "Profile not found"})
+    prof, meta = files
+    if metadata:
+        return FileResponse(meta, media_type="application/json")
+    return FileResponse(prof, media_type="application/octet-stream", filename=prof.name)
+
+
+@router.get("/admin/bcrypt")
+def bcrypt_status(request: Request):
+    """
+    Show the bcrypt cost calibration and the cost of stored password hashes.
+
+    Returns:
+        JSONResponse: Calibration and cost distribution, or error.
+    """
+
+    if not is_admin(request):
+        return JSONResponse(status_code=403, content={"error": "Admin key required"})
+    return JSONResponse(content=auth.bcrypt_report())
+
+
+@router.get("/admin/search")
+def search_all_articles(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Search query"),
+    limit: int = Query(20, ge=1, le=500, description="Number of results"),
 ):
-    updated = particles.edit_particle(
-        username=payload.username,
-        password=payload.password,
-        particle_id=article_id,
-        new_title=new_title,
-        new_content=new_content
+    """
+    Search every user's articles, streaming results as newline-delimited JSON.
+
+    Each line carries the ranked matches of one scanned ID range; the last
+    line has "done": true and the overall top results. Closing the connection
+    cancels the ranges not scanned yet.
+
+    Args:
+        q (str): Search query.
+        limit (int): Number of results.
+
+    Returns:
+        StreamingResponse: NDJSON lines, or JSONResponse error.
+    """
+
+    if not is_admin(request):
+        return JSONResponse(status_code=403, content={"error": "Admin key required"})
+
+    async def lines():
+        async for chunk in search.search_all(q, limit):
+            yield json.dumps(chunk) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def create_app(settings: Optional[config.Config] = None) -> FastAPI:
+    """
+    Build the API against the database described by settings.
+
+    The database connection settings are process wide, so only one app per
+    process should be serving at a time.
+
+    Args:
+        settings (Optional[config.Config]): Settings to use. Read from the environment if omitted.
+
+    Returns:
+        FastAPI: The configured application.
+    """
+    if settings is None:
+        settings = config.load_config()
+
+    database.configure(settings)
+    database.init_db()
+    stats.ensure_populated()
+    particles.backfill_previews()
+    auth.load_user_index()
+    auth.configure_bcrypt(settings)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        writer.stop()
+        search.shutdown()
+        if settings.in_memory and settings.snapshot_path:
+            database.save_snapshot(settings.snapshot_path)
+
+    app = FastAPI(title="PIM API", version="1.0.0", lifespan=lifespan)
+    app.state.settings = settings
+
+    # CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
-    if not updated:
-        return JSONResponse(status_code=403, content={"error": "Edit failed. Check credentials or no changes provided."})
-    return JSONResponse(content={"message": "Article updated"})
 
+    # Admission control for bcrypt backed endpoints. The limits are for the whole
+    # server, so each of the serve.py workers enforces its share of them
+    workers = max(1, settings.workers)
+    app.state.auth_admission = ratelimit.AdmissionController(
+        ip_limiter=ratelimit.TokenBucketLimiter(
+            rate=settings.auth_ip_rate / workers, burst=-(-settings.auth_ip_burst // workers)
+        ),
+        user_limiter=ratelimit.TokenBucketLimiter(
+            rate=settings.auth_user_rate / workers, burst=-(-settings.auth_user_burst // workers)
+        ),
+        max_concurrent=max(1, (settings.auth_max_concurrent or os.cpu_count() or 1) // workers),
+    )
+    app.add_exception_handler(ratelimit.RateLimited, rate_limited_handler)
 
-@app.get("/particles/{article_id}")
-def get_article(article_id: str):
-    item = particles.get_article_by_id(article_id)
-    if not item:
-        return JSONResponse(status_code=404, content={"error": "Article not found"})
-    return JSONResponse(content=item)
+    # Opt-in per-request profiling; a pass-through unless an admin key or sample rate is set
+    app.add_middleware(profiling.ProfilingMiddleware, settings=settings)
+
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name):
+    # Build the default app on first access of main.app (e.g. "uvicorn main:app"),
+    # so importing this module has no side effects
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    # Single-process development server; use serve.py for multiple workers
+    settings = config.load_config()
+    uvicorn.run("main:create_app", factory=True, host=settings.host, port=settings.port, reload=True)
@@ -2,50 +2,115 @@
 This file handles all operations on particles
 """
 
-import sqlite3
+import attachments
 import auth
+import database
+import leaderboard
+import revisions
+import writer
 
-def view_articles(username: str):
+PREVIEW_CHARS = 200
+
+# Columns returned by list views; content is only added when the full body is asked for
+LIST_COLUMNS = "article_id, title, preview, word_count, byte_size"
+
+def summarize(content: str):
+    """
+    Compute the stored preview fields for a particle body.
+
+    Args:
+        content (str): Particle content.
+
+    Returns:
+        tuple: (preview, word_count, byte_size).
+    """
+    return content[:PREVIEW_CHARS], len(content.split()), len(content.encode('utf-8'))
+
+def _list_item(id_key: str, row, full: bool):
+    """
+    Build a list view entry from a row selected with LIST_COLUMNS (plus content if full).
+    """
+    item = {id_key: row[0], 'title': row[1], 'preview': row[2], 'word_count': row[3], 'byte_size': row[4]}
+    if full:
+        item['content'] = row[5]
+    return item
+
+def view_articles(username: str, full: bool = False):
     """
     Return all articles of a user as a list of dictionaries.
 
     Args:
         username (str): Username of the user.
+        full (bool): Include the full content, not only the preview.
 
     Returns:
         list[dict]: List of articles.
     """
-    conn = sqlite3.connect('db/pim.db')
+    columns = LIST_COLUMNS + (", content" if full else "")
+    conn = database.connect()
     cursor = conn.cursor()
-    cursor.execute("SELECT article_id, title, content FROM particles WHERE username = ?", (username,))
+    cursor.execute(f"SELECT {columns} FROM particles WHERE username = ?", (username,))
     rows = cursor.fetchall()
     conn.close()
 
-    return [{'particle_id': row[0], 'title': row[1], 'content': row[2]} for row in rows]
+    return [_list_item('particle_id', row, full) for row in rows]
 
-def search_article(username: str, search_term: str):
+def search_article(username: str, search_term: str, full: bool = False):
     """
     Return articles of a user where the title or content matches the search term.
 
     Args:
         username (str): Username of the user.
         search_term (str): Search term.
+        full (bool): Include the full content, not only the preview.
 
     Returns:
         list[dict]: List of matching articles.
     """
-    conn = sqlite3.connect('db/pim.db')
+    columns = LIST_COLUMNS + (", content" if full else "")
+    conn = database.connect()
     cursor = conn.cursor()
     like_term = f'%{search_term}%'
-    cursor.execute("""
-        SELECT article_id, title, content FROM particles 
+    cursor.execute(f"""
+        SELECT {columns} FROM particles 
         WHERE username = ? AND (title LIKE ? OR content LIKE ?)
         """, (username, like_term, like_term))
     
     rows = cursor.fetchall()
     conn.close()
 
-    return [{'article_id': row[0], 'title': row[1], 'content': row[2]} for row in rows]
+    return [_list_item('article_id', row, full) for row in rows]
+
+def get_article_by_id(particle_id: int):
+    """
+    Return a single article including its full content.
+
+    Args:
+        particle_id (int): Particle ID.
+
+    Returns:
+        dict or None: Article or None if not found.
+    """
+    conn = database.connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT article_id, username, title, content, word_count, byte_size, COALESCE(views, 0) FROM particles WHERE article_id = ?",
+        (particle_id,),
+    )
+    row = cursor.fetchone()
+    conn.close()
+
+    if not row:
+        return None
+    return {
+        'particle_id': row[0],
+        'username': row[1],
+        'title': row[2],
+        'content': row[3],
+        'word_count': row[4],
+        'byte_size': row[5],
+        'views': row[6],
+    }
 
 
 def delete_article(particle_id: int):
@@ -58,13 +123,16 @@ def delete_article(particle_id: int):
     Returns:
         bool: True if deleted, False otherwise.
     """
-    conn = sqlite3.connect('db/pim.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM particles WHERE article_id = ?", (particle_id,))
-    conn.commit()
-    deleted = cursor.rowcount > 0
+    def delete(conn):
+        cursor = conn.execute("DELETE FROM particles WHERE article_id = ?", (particle_id,))
+        revisions.delete_for_article(conn, particle_id)
+        leaderboard.delete_for_article(conn, particle_id)
+        return cursor.rowcount > 0
 
-    conn.close()
+    deleted = writer.submit(delete)
+
+    if deleted:
+        attachments.delete_for_article(particle_id)
 
     return deleted
 
@@ -91,9 +159,6 @@ def edit_particle(username: str, password: str, particle_id: str, new_title: str
     if new_title is None and new_content is None:
         return False
 
-    conn = sqlite3.connect('db/pim.db')
-    cursor = conn.cursor()
-
     # Build the update query dynamically
     fields = []
     values = []
@@ -101,18 +166,56 @@ def edit_particle(username: str, password: str, particle_id: str, new_title: str
         fields.append("title = ?")
         values.append(new_title)
     if new_content is not None:
-        fields.append("content = ?")
+        fields.append("content = ?, preview = ?, word_count = ?, byte_size = ?")
         values.append(new_content)
+        values.extend(summarize(new_content))
     values.extend([username, particle_id])
 
     query = f"UPDATE particles SET {', '.join(fields)} WHERE username = ? AND article_id = ?"
-    cursor.execute(query, tuple(values))
-    conn.commit()
-    updated = cursor.rowcount > 0
+
+    # Diff against a pre-read copy, outside the write transaction; record() re-checks it
+    conn = database.connect()
+    current = conn.execute(
+        "SELECT content FROM particles WHERE username = ? AND article_id = ?", (username, particle_id)
+    ).fetchone()
     conn.close()
+    if not current:
+        return False
+    prepared = revisions.prepare(current[0], current[0] if new_content is None else new_content)
+
+    def update(conn):
+        old = conn.execute(
+            "SELECT title, content FROM particles WHERE username = ? AND article_id = ?", (username, particle_id)
+        ).fetchone()
+        if not old:
+            return False
+        conn.execute(query, tuple(values))
+        new = (old[0] if new_title is None else new_title, old[1] if new_content is None else new_content)
+        revisions.record(conn, particle_id, old, new, prepared)
+        return True
+
+    updated = writer.submit(update)
     
     return updated
 
+def get_article_owner(particle_id: int):
+    """
+    Return the username that owns a particle.
+
+    Args:
+        particle_id (int): Particle ID.
+
+    Returns:
+        str or None: Owner username, or None if the particle does not exist.
+    """
+    conn = database.connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT username FROM particles WHERE article_id = ?", (particle_id,))
+    row = cursor.fetchone()
+    conn.close()
+
+    return row[0] if row else None
+
 def particle_views_count(particle_id):
     """
     Increment and return the number of times a particle has been viewed.
@@ -123,17 +226,12 @@ def particle_views_count(particle_id):
     Returns:
         int: Number of views.
     """
-    conn = sqlite3.connect('db/pim.db')
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(particles)")
-    columns = [col[1] for col in cursor.fetchall()]
-    if 'views' not in columns:
-        cursor.execute("ALTER TABLE particles ADD COLUMN views INTEGER DEFAULT 0")
-        conn.commit()
-    cursor.execute("UPDATE particles SET views = COALESCE(views, 0) + 1 WHERE article_id = ?", (particle_id,))
-    conn.commit()
-    cursor.execute("SELECT views FROM particles WHERE article_id = ?", (particle_id,))
-    result = cursor.fetchone()
+    def add_view(conn):
+        _add_view(conn, particle_id)
+        return conn.execute("SELECT views FROM particles WHERE article_id = ?", (particle_id,)).fetchone()
+
+    conn = database.connect()
+    result = database.execute_transaction(conn, add_view)
     conn.close()
     return result[0] if result else 0
 
@@ -149,20 +247,18 @@ def create_article(username: str, title: str, content: str):
     Returns:
         int or None: Article ID if created, else None.
     """
-    conn = sqlite3.connect('db/pim.db')
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("INSERT INTO particles (username, title, content) VALUES (?, ?, ?)", 
-                      (username, title, content))
-        conn.commit()
-        article_id = cursor.lastrowid
+        def insert(conn):
+            # No revision yet: the row is version 1 until the first edit (see revisions.py)
+            cursor = conn.execute("INSERT INTO particles (username, title, content, preview, word_count, byte_size) VALUES (?, ?, ?, ?, ?, ?)", 
+                          (username, title, content, *summarize(content)))
+            return cursor.lastrowid
+
+        article_id = writer.submit(insert)
         return article_id
     except Exception as e:
         print(f"Error creating article: {e}")
         return None
-    finally:
-        conn.close()
 
 
 def particles_view_adder(particle_id):
@@ -175,8 +271,37 @@ def particles_view_adder(particle_id):
     Returns:
         None
     """
-    conn = sqlite3.connect('db/pim.db')
+    conn = database.connect()
+    database.execute_transaction(conn, lambda c: _add_view(c, particle_id))
+    conn.close()
+
+
+def _add_view(conn, particle_id):
+    """
+    Count a view in particles.views and in the windowed rankings, inside the caller's transaction.
+    """
+    cursor = conn.execute("UPDATE particles SET views = COALESCE(views, 0) + 1 WHERE article_id = ?", (particle_id,))
+    if cursor.rowcount:
+        leaderboard.record_view(conn, particle_id)
+
+
+def backfill_previews():
+    """
+    Fill in preview, word_count and byte_size for particles written before
+    those columns existed.
+
+    Returns:
+        int: Number of particles updated.
+    """
+    conn = database.connect()
     cursor = conn.cursor()
-    cursor.execute("UPDATE particles SET views = COALESCE(views, 0) + 1 WHERE article_id = ?", (particle_id,))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    cursor.execute("SELECT article_id, content FROM particles WHERE preview IS NULL")
+    rows = cursor.fetchall()
+    if rows:
+        cursor.executemany(
+            "UPDATE particles SET preview = ?, word_count = ?, byte_size = ? WHERE article_id = ?",
+            [(*summarize(content), article_id) for article_id, content in rows],
+        )
+        conn.commit()
+    conn.close()
+    return len(rows)
@@ -0,0 +1,217 @@
+"""
+This file handles opt-in profiling of single requests.
+
+A request is profiled when it carries "X-PIM-Profile: <admin key>" or is
+picked by the sampling rate. Its endpoint then runs under cProfile (in the
+thread it actually runs in), every SQL statement it executes is logged, and
+the result is saved to profile_dir as <id>.prof (pstats) plus <id>.json
+(route, timing, status, SQL). Only the newest profile_keep profiles are kept.
+Saving runs in the threadpool, so a sampled request never stalls the event loop.
+
+Async endpoints are profiled on the event loop thread, so their profile also
+holds whatever other coroutines ran while they awaited; their metadata says so
+with "shared_event_loop": true.
+
+When neither a key nor a sampling rate is configured the middleware is a
+straight pass-through, and endpoints only pay for one ContextVar lookup.
+"""
+
+import cProfile
+import functools
+import inspect
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+from starlette.concurrency import run_in_threadpool
+
+import config
+import database
+
+PROFILE_HEADER = b"x-pim-profile"
+
+_active_run = ContextVar("pim_profile_run", default=None)
+
+# cProfile can't reliably run two profilers at once, so only one request is profiled at a time
+_profiling_lock = threading.Lock()
+
+
+class ProfileRun:
+    """
+    Everything collected while one request is profiled.
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.statements = []
+        self.shared_event_loop = False  # set for async endpoints, see the module docstring
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute whose endpoint runs under the request's profiler, if it has one.
+
+    Wrapping the endpoint (rather than profiling in the middleware) means sync
+    endpoints are profiled inside the threadpool thread that runs them.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def profiled(*args, **kw):
+                run = _active_run.get()
+                if run is None:
+                    return await endpoint(*args, **kw)
+                run.shared_event_loop = True
+                run.profiler.enable()
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    run.profiler.disable()
+        else:
+            @functools.wraps(endpoint)
+            def profiled(*args, **kw):
+                run = _active_run.get()
+                if run is None:
+                    return endpoint(*args, **kw)
+                return run.profiler.runcall(endpoint, *args, **kw)
+
+        super().__init__(path, profiled, **kwargs)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that decides which requests to profile and saves the results.
+    """
+
+    def __init__(self, app, settings: config.Config):
+        """
+        Args:
+            app: Wrapped ASGI app.
+            settings (config.Config): Provides admin_key, profile_sample_rate, profile_dir, profile_keep.
+        """
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        enabled = self.settings.admin_key or self.settings.profile_sample_rate > 0
+        if not enabled or scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _profiling_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        run = ProfileRun()
+        status = []
+
+        async def record_status(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        run_token = _active_run.set(run)
+        log_token = database.statement_log.set(run.statements)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            duration = time.perf_counter() - started
+            database.statement_log.reset(log_token)
+            _active_run.reset(run_token)
+            _profiling_lock.release()
+            await run_in_threadpool(save_profile, self.settings, scope, run, status[0] if status else 500, duration)
+
+    def _wanted(self, scope) -> bool:
+        """
+        Check the profiling header, then the sampling rate.
+        """
+        key = self.settings.admin_key
+        if key:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return secrets.compare_digest(value, key.encode())
+        return random.random() < self.settings.profile_sample_rate
+
+
+def save_profile(settings: config.Config, scope, run: ProfileRun, status: int, duration: float) -> str:
+    """
+    Write a profile and its metadata to profile_dir, then drop the oldest
+    profiles beyond profile_keep.
+
+    Returns:
+        str: Profile ID.
+    """
+    route = getattr(scope.get("route"), "path", None) or scope["path"]
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    profile_id = f"{time.time_ns()}-{scope['method'].lower()}-{slug}"
+
+    directory = Path(settings.profile_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    run.profiler.dump_stats(directory / f"{profile_id}.prof")
+    metadata = {
+        "id": profile_id,
+        "method": scope["method"],
+        "route": route,
+        "path": scope["path"],
+        "status": status,
+        "duration_ms": round(duration * 1000, 3),
+        "created": time.time(),
+        "shared_event_loop": run.shared_event_loop,
+        "sql": run.statements,
+    }
+    (directory / f"{profile_id}.json").write_text(json.dumps(metadata))
+
+    for old in sorted(directory.glob("*.json"))[:-settings.profile_keep]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".prof").unlink(missing_ok=True)
+    return profile_id
+
+
+def list_profiles(settings: config.Config):
+    """
+    Return the metadata of saved profiles, newest first (SQL omitted).
+
+    Args:
+        settings (config.Config): Provides profile_dir.
+
+    Returns:
+        list[dict]: Profile metadata.
+    """
+    items = []
+    for path in sorted(Path(settings.profile_dir).glob("*.json"), reverse=True):
+        try:
+            metadata = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue  # rotated away or half written
+        metadata["sql_count"] = len(metadata.pop("sql"))
+        items.append(metadata)
+    return items
+
+
+def profile_files(settings: config.Config, profile_id: str) -> Optional[tuple]:
+    """
+    Return the (.prof, .json) paths of a saved profile.
+
+    Args:
+        settings (config.Config): Provides profile_dir.
+        profile_id (str): Profile ID from list_profiles.
+
+    Returns:
+        tuple or None: Paths, or None if the ID is invalid or was rotated away.
+    """
+    if not re.fullmatch(r"[A-Za-z0-9-]+", profile_id):
+        return None
+    directory = Path(settings.profile_dir)
+    prof, meta = directory / f"{profile_id}.prof", directory / f"{profile_id}.json"
+    if not prof.exists() or not meta.exists():
+        return None
+    return prof, meta
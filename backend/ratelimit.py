@@ -0,0 +1,157 @@
+"""
+This file handles admission control for expensive (bcrypt backed) endpoints
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request is shed before doing any expensive work.
+
+    Args:
+        retry_after (float): Seconds until the caller may try again.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by a string such as a client IP or a username.
+
+    Each key only stores (tokens, last_seen). Keys are kept in an OrderedDict in
+    last-seen order, so buckets that have been idle long enough to be full again
+    are dropped from the front as new requests arrive. Every call is O(1)
+    amortised and the table never holds more than max_keys entries.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            burst (int): Bucket capacity.
+            max_keys (int): Upper bound on the number of tracked keys.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._idle_ttl = burst / rate  # a bucket idle this long is full again
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """
+        Take one token from the bucket for key.
+
+        Args:
+            key (str): Bucket key.
+
+        Returns:
+            float: 0.0 if a token was taken, else seconds until one is available.
+        """
+        return acquire_all([(self, key)])
+
+    def _refill(self, key: str, now: float) -> float:
+        """
+        Return the tokens in the bucket for key at time now. The caller holds
+        the lock and stores the bucket back with _store.
+        """
+        self._expire(now)
+        entry = self._buckets.pop(key, None)
+        if entry is None:
+            return float(self.burst)
+        tokens, last_seen = entry
+        return min(self.burst, tokens + (now - last_seen) * self.rate)
+
+    def _store(self, key: str, tokens: float, now: float) -> None:
+        """
+        Put a bucket back at the end of the last-seen order.
+        """
+        self._buckets[key] = (tokens, now)
+
+    def _expire(self, now: float) -> None:
+        """
+        Drop buckets from the front of the table that are full again or over capacity.
+
+        Args:
+            now (float): Current monotonic time.
+        """
+        while self._buckets:
+            key = next(iter(self._buckets))
+            _, last_seen = self._buckets[key]
+            if now - last_seen < self._idle_ttl and len(self._buckets) < self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+
+def acquire_all(requests: list) -> float:
+    """
+    Take one token from each of several buckets, or from none of them.
+
+    Every limiter is locked while the buckets are checked, so a request
+    rejected by one bucket never drains another.
+
+    Args:
+        requests (list[tuple]): (TokenBucketLimiter, key) pairs with distinct
+            limiters, always listed in the same order.
+
+    Returns:
+        float: 0.0 if every token was taken, else seconds until all are available.
+    """
+    now = time.monotonic()
+    with ExitStack() as stack:
+        for limiter, _ in requests:
+            stack.enter_context(limiter._lock)
+
+        tokens = [limiter._refill(key, now) for limiter, key in requests]
+        wait = max((1 - left) / limiter.rate if left < 1 else 0.0 for (limiter, _), left in zip(requests, tokens))
+        for (limiter, key), left in zip(requests, tokens):
+            limiter._store(key, left if wait else left - 1, now)
+        return wait
+
+
+class AdmissionController:
+    """
+    Per-IP and per-username token buckets plus a global concurrency budget.
+    """
+
+    def __init__(self, ip_limiter: TokenBucketLimiter, user_limiter: TokenBucketLimiter, max_concurrent: int):
+        """
+        Args:
+            ip_limiter (TokenBucketLimiter): Limiter keyed by client IP.
+            user_limiter (TokenBucketLimiter): Limiter keyed by username.
+            max_concurrent (int): Number of expensive requests allowed in flight at once.
+        """
+        self.ip_limiter = ip_limiter
+        self.user_limiter = user_limiter
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def admit(self, ip: str, username: str):
+        """
+        Admit one expensive request or raise RateLimited straight away.
+
+        Args:
+            ip (str): Client IP address.
+            username (str): Username the request acts on.
+
+        Raises:
+            RateLimited: If either bucket is empty or no concurrency slot is free.
+        """
+        wait = acquire_all([(self.ip_limiter, ip), (self.user_limiter, username)])
+        if wait:
+            raise RateLimited(wait)
+
+        # Never queue behind bcrypt: if every slot is busy, shed the request
+        if not self._slots.acquire(blocking=False):
+            raise RateLimited(1.0)
+        try:
+            yield
+        finally:
+            self._slots.release()
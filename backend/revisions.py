@@ -0,0 +1,289 @@
+"""
+This file keeps the edit history of particles.
+
+Every edit stores a revision. Creating a particle stores nothing: until its
+first edit the particles row is its only version, and that edit saves the
+original as version 1. Most revisions are word-level deltas against the
+previous version; a full snapshot is stored every SNAPSHOT_EVERY versions (or
+whenever a delta would not be smaller), so rebuilding any version applies at
+most SNAPSHOT_EVERY - 1 deltas.
+
+A delta is a JSON list whose items are either [start, end], meaning "copy
+tokens start..end of the previous version", or a string of inserted text.
+Tokens are words with their trailing whitespace, so a delta grows with the
+size of the change rather than the size of the particle.
+"""
+
+import json
+import re
+import sqlite3
+import time
+from difflib import SequenceMatcher
+from typing import Optional
+
+import database
+
+SNAPSHOT_EVERY = 10
+MAX_REVISIONS = 50  # older revisions are compacted away
+# SequenceMatcher is quadratic on repetitive text; larger changed regions are stored as snapshots
+MAX_DIFF_TOKENS = 2000
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+def _tokens(text: str) -> list:
+    """
+    Split text into tokens that join back to exactly the same text.
+    """
+    return _TOKEN.findall(text)
+
+
+def make_delta(old: str, new: str) -> Optional[str]:
+    """
+    Encode new as edits against old, at word granularity.
+
+    The common start and end are copied as is; only the region in between
+    is diffed, and only if it has at most MAX_DIFF_TOKENS tokens.
+
+    Args:
+        old (str): Previous content.
+        new (str): New content.
+
+    Returns:
+        str or None: JSON delta, or None if the changed region is too large to diff cheaply.
+    """
+    old_tokens = _tokens(old)
+    new_tokens = _tokens(new)
+
+    shortest = min(len(old_tokens), len(new_tokens))
+    prefix = 0
+    while prefix < shortest and old_tokens[prefix] == new_tokens[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and old_tokens[-1 - suffix] == new_tokens[-1 - suffix]:
+        suffix += 1
+    old_middle = old_tokens[prefix:len(old_tokens) - suffix]
+    new_middle = new_tokens[prefix:len(new_tokens) - suffix]
+    if max(len(old_middle), len(new_middle)) > MAX_DIFF_TOKENS:
+        return None
+
+    ops = [[0, prefix]] if prefix else []
+    matcher = SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([prefix + i1, prefix + i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(new_middle[j1:j2]))
+    if suffix:
+        ops.append([len(old_tokens) - suffix, len(old_tokens)])
+    return json.dumps(ops, separators=(",", ":"))
+
+
+def apply_delta(old: str, delta: str) -> str:
+    """
+    Rebuild a version from the previous one and its delta.
+
+    Args:
+        old (str): Previous content.
+        delta (str): JSON delta made by make_delta.
+
+    Returns:
+        str: The new content.
+    """
+    old_tokens = _tokens(old)
+    parts = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_tokens[op[0]:op[1]])
+    return "".join(parts)
+
+
+def prepare(old_content: str, new_content: str) -> tuple:
+    """
+    Diff an edit before its write transaction starts, so the write lock (and
+    the group-commit batch) never waits on make_delta.
+
+    Args:
+        old_content (str): Content read before the transaction.
+        new_content (str): Content after the edit.
+
+    Returns:
+        tuple: (old_content, delta or None), to pass to record().
+    """
+    return old_content, make_delta(old_content, new_content)
+
+
+def record(conn: sqlite3.Connection, article_id: int, old: tuple, new: tuple, prepared: Optional[tuple] = None) -> int:
+    """
+    Store a new revision of an edited particle. Runs inside the caller's write
+    transaction, next to the statement that changed the particle.
+
+    No diffing happens here: the delta from prepare() is used if its base is
+    still the current content, otherwise the revision is stored as a snapshot.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        article_id (int): Particle ID.
+        old (tuple): (title, content) before the change.
+        new (tuple): (title, content) after the change.
+        prepared (Optional[tuple]): Result of prepare() for this edit.
+
+    Returns:
+        int: The new version number.
+    """
+    title, new_content = new
+    old_content = old[1]
+
+    latest = conn.execute(
+        "SELECT MAX(version), MAX(CASE WHEN kind = 'snapshot' THEN version END) FROM particle_revisions WHERE article_id = ?",
+        (article_id,),
+    ).fetchone()
+    version, last_snapshot = latest if latest[0] is not None else (0, None)
+
+    if version == 0:
+        # First edit (or a particle older than revision history); keep the original as the base
+        _insert(conn, article_id, 1, old[0], "snapshot", old_content, old_content)
+        version, last_snapshot = 1, 1
+
+    version += 1
+    kind, body = "snapshot", new_content
+    if version - last_snapshot < SNAPSHOT_EVERY and prepared:
+        base, delta = prepared
+        if delta is not None and base == old_content and len(delta) < len(new_content):
+            kind, body = "delta", delta
+
+    _insert(conn, article_id, version, title, kind, body, new_content)
+    _compact(conn, article_id, version)
+    return version
+
+
+def _insert(conn, article_id, version, title, kind, body, content) -> None:
+    """
+    Insert one revision row.
+    """
+    conn.execute(
+        "INSERT INTO particle_revisions (article_id, version, title, kind, body, size, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (article_id, version, title, kind, body, len(content), int(time.time())),
+    )
+
+
+def _compact(conn: sqlite3.Connection, article_id: int, latest: int) -> None:
+    """
+    Drop revisions beyond MAX_REVISIONS. The oldest kept revision is rewritten
+    as a snapshot first, so the remaining chain still rebuilds on its own.
+
+    Compaction only runs once SNAPSHOT_EVERY extra revisions have piled up, so
+    its cost is spread over many edits.
+    """
+    oldest = conn.execute(
+        "SELECT MIN(version) FROM particle_revisions WHERE article_id = ?", (article_id,)
+    ).fetchone()[0]
+    if latest - oldest + 1 <= MAX_REVISIONS + SNAPSHOT_EVERY:
+        return
+
+    keep_from = latest - MAX_REVISIONS + 1
+    title, content = _rebuild(conn, article_id, keep_from)
+    conn.execute(
+        "UPDATE particle_revisions SET kind = 'snapshot', body = ? WHERE article_id = ? AND version = ?",
+        (content, article_id, keep_from),
+    )
+    conn.execute("DELETE FROM particle_revisions WHERE article_id = ? AND version < ?", (article_id, keep_from))
+
+
+def _rebuild(conn: sqlite3.Connection, article_id: int, version: int) -> Optional[tuple]:
+    """
+    Rebuild (title, content) of one version from the nearest snapshot at or
+    before it.
+    """
+    rows = conn.execute(
+        """
+        SELECT version, title, kind, body FROM particle_revisions
+        WHERE article_id = ? AND version <= ? AND version >= (
+            SELECT MAX(version) FROM particle_revisions
+            WHERE article_id = ? AND version <= ? AND kind = 'snapshot'
+        )
+        ORDER BY version
+        """,
+        (article_id, version, article_id, version),
+    ).fetchall()
+    if not rows or rows[-1][0] != version:
+        return None
+
+    content = None
+    for _, _, kind, body in rows:
+        content = body if kind == "snapshot" else apply_delta(content, body)
+    return rows[-1][1], content
+
+
+def _current(conn: sqlite3.Connection, article_id: int) -> Optional[tuple]:
+    """
+    Return (title, content) of a particle that has no stored revisions, which
+    is then its version 1.
+    """
+    return conn.execute(
+        "SELECT title, content FROM particles WHERE article_id = ? "
+        "AND NOT EXISTS (SELECT 1 FROM particle_revisions WHERE article_id = ?)",
+        (article_id, article_id),
+    ).fetchone()
+
+
+def list_revisions(article_id: int):
+    """
+    Return the revisions of a particle, newest first, without bodies. A
+    particle that was never edited has one version: its current row, listed
+    with kind "current" and no stored size or time.
+
+    Args:
+        article_id (int): Particle ID.
+
+    Returns:
+        list[dict]: Revision metadata.
+    """
+    conn = database.connect()
+    rows = conn.execute(
+        "SELECT version, title, kind, size, LENGTH(body), created FROM particle_revisions "
+        "WHERE article_id = ? ORDER BY version DESC",
+        (article_id,),
+    ).fetchall()
+    if not rows:
+        current = _current(conn, article_id)
+        rows = [(1, current[0], "current", len(current[1]), 0, None)] if current else []
+    conn.close()
+    return [
+        {"version": row[0], "title": row[1], "kind": row[2], "size": row[3], "stored_size": row[4], "created": row[5]}
+        for row in rows
+    ]
+
+
+def get_version(article_id: int, version: int) -> Optional[dict]:
+    """
+    Rebuild one version of a particle.
+
+    Args:
+        article_id (int): Particle ID.
+        version (int): Version number.
+
+    Returns:
+        dict or None: {"version", "title", "content"} or None if not stored.
+    """
+    conn = database.connect()
+    rebuilt = _rebuild(conn, article_id, version)
+    if rebuilt is None and version == 1:
+        rebuilt = _current(conn, article_id)
+    conn.close()
+    if not rebuilt:
+        return None
+    return {"version": version, "title": rebuilt[0], "content": rebuilt[1]}
+
+
+def delete_for_article(conn: sqlite3.Connection, article_id: int) -> None:
+    """
+    Delete the history of a particle, inside the caller's transaction.
+
+    Args:
+        conn (sqlite3.Connection): Connection holding the write transaction.
+        article_id (int): Particle ID.
+    """
+    conn.execute("DELETE FROM particle_revisions WHERE article_id = ?", (article_id,))
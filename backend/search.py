@@ -0,0 +1,204 @@
+"""
+This file runs admin searches across every user's particles.
+
+The particle ID space is cut into ranges that are scanned concurrently in a
+process pool, each worker over its own read-only connection, so a corpus-wide
+LIKE scan uses every core instead of one. Each range returns its own ranked
+top k; the caller merges them as they finish, which is what lets the HTTP
+endpoint stream partial results and stop handing out ranges once the client
+goes away.
+
+An in-memory database only exists inside this process, so in that mode the
+ranges run on threads instead (sqlite3 releases the GIL while it scans).
+"""
+
+import asyncio
+import heapq
+import multiprocessing
+import os
+import sqlite3
+import string
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator
+
+from starlette.concurrency import run_in_threadpool
+
+import database
+
+RANGES_PER_WORKER = 4  # smaller ranges mean finer progress and quicker cancellation
+TITLE_WEIGHT = 3  # a hit in the title counts as much as this many hits in the content
+
+# SQLite's LOWER() and LIKE only fold ASCII letters; the needle is lowered the same way
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+_executor = None
+_executor_kind = None
+_executor_lock = threading.Lock()
+
+
+def _escape_like(term: str) -> str:
+    """
+    Escape LIKE wildcards so the term matches literally.
+    """
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_range(uri: str, term: str, low: int, high: int, limit: int) -> list:
+    """
+    Rank the particles with low <= article_id < high that contain term.
+
+    Runs in a pool worker, so it only takes plain values and opens its own
+    connection.
+
+    Args:
+        uri (str): SQLite URI of the database, read-only for files.
+        term (str): Search term, matched case-insensitively.
+        low (int): First article ID of the range.
+        high (int): End of the range (exclusive).
+        limit (int): Most results to return.
+
+    Returns:
+        list[tuple]: (score, article_id, username, title, preview), best first.
+    """
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    needle = term.translate(_ASCII_LOWER)
+    pattern = f"%{_escape_like(term)}%"
+    # Occurrences of the term, counted as the length the term's removal takes off
+    rows = conn.execute(
+        """
+        SELECT score, article_id, username, title, preview FROM (
+            SELECT article_id, username, title, preview,
+                ? * (LENGTH(title) - LENGTH(REPLACE(LOWER(title), ?, ''))) / LENGTH(?)
+                + (LENGTH(content) - LENGTH(REPLACE(LOWER(content), ?, ''))) / LENGTH(?) AS score
+            FROM particles
+            WHERE article_id >= ? AND article_id < ?
+              AND (title LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')
+        )
+        ORDER BY score DESC, article_id
+        LIMIT ?
+        """,
+        (TITLE_WEIGHT, needle, needle, needle, needle, low, high, pattern, pattern, limit),
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def id_ranges(count: int):
+    """
+    Split the current article ID span into up to count ranges.
+
+    Args:
+        count (int): Number of ranges wanted.
+
+    Returns:
+        list[tuple]: (low, high) pairs, high exclusive; empty if there are no particles.
+    """
+    conn = database.connect()
+    low, high = conn.execute("SELECT MIN(article_id), MAX(article_id) FROM particles").fetchone()
+    conn.close()
+    if low is None:
+        return []
+
+    span = high - low + 1
+    step = max(1, -(-span // count))
+    return [(start, min(start + step, high + 1)) for start in range(low, high + 1, step)]
+
+
+def pool_size(settings) -> int:
+    """
+    Return how many ranges this process scans at once: its share of
+    search_workers (default one per CPU) among the serve.py workers.
+
+    Args:
+        settings (config.Config): Provides search_workers and workers.
+
+    Returns:
+        int: Pool size, at least 1.
+    """
+    return max(1, (settings.search_workers or os.cpu_count() or 1) // max(1, settings.workers))
+
+
+def _pool() -> Executor:
+    """
+    Return the shared pool for the configured database, starting it if needed.
+    """
+    global _executor, _executor_kind
+    settings = database.settings()
+    kind = "thread" if settings.in_memory else "process"
+    workers = pool_size(settings)
+    with _executor_lock:
+        if _executor_kind != (kind, workers):
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            if kind == "thread":
+                _executor = ThreadPoolExecutor(workers, thread_name_prefix="pim-search")
+            else:
+                # spawn, not fork: the server process has threads (writer, rehash) that fork would copy mid-flight
+                _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _executor_kind = (kind, workers)
+        return _executor
+
+
+def _item(row) -> dict:
+    """
+    Build a result entry from a search_range row.
+    """
+    return {"score": row[0], "article_id": row[1], "username": row[2], "title": row[3], "preview": row[4]}
+
+
+async def search_all(term: str, limit: int) -> AsyncIterator[dict]:
+    """
+    Search every particle, yielding each range's results as it finishes and
+    then the merged top results.
+
+    Ranges that have not started yet are cancelled as soon as the caller
+    stops iterating (e.g. the client disconnected).
+
+    Args:
+        term (str): Search term.
+        limit (int): Most results overall.
+
+    Yields:
+        dict: {"range": [low, high], "items": [...]} per finished range, then
+        {"done": True, "ranges": n, "items": [...]} with the overall top results.
+    """
+    settings = database.settings()
+    uri = database.read_only_uri()
+    workers = pool_size(settings)
+
+    def submit_all():
+        # Blocking: reads the ID span, and the first submit spawns the pool's processes
+        pool = _pool()
+        ranges = id_ranges(workers * RANGES_PER_WORKER)
+        return ranges, [pool.submit(search_range, uri, term, low, high, limit) for low, high in ranges]
+
+    ranges, submitted = await run_in_threadpool(submit_all)
+    futures = {asyncio.wrap_future(future): bounds for future, bounds in zip(submitted, ranges)}
+    best = []
+    pending = set(futures)
+    try:
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                rows = future.result()
+                best = heapq.nsmallest(limit, best + rows, key=lambda row: (-row[0], row[1]))
+                if rows:
+                    yield {"range": list(futures[future]), "items": [_item(row) for row in rows]}
+        yield {"done": True, "ranges": len(ranges), "items": [_item(row) for row in best]}
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def shutdown() -> None:
+    """
+    Stop the search pool, dropping queued ranges.
+    """
+    global _executor, _executor_kind
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _executor_kind = None
@@ -0,0 +1,56 @@
+"""
+Production entry point: runs several uvicorn worker processes against one SQLite database
+
+Configure with environment variables (see config.py), e.g.
+
+    PIM_DB_PATH=/var/lib/pim/pim.db PIM_WORKERS=4 python serve.py
+"""
+
+import json
+import os
+
+import uvicorn
+
+import auth
+import config
+import database
+import particles
+import stats
+
+
+def main():
+    """
+    Prepare the database once, then fork the workers.
+
+    Each worker re-reads the same PIM_* environment, so they all agree on the
+    absolute database path.
+    """
+    # One worker per CPU unless PIM_WORKERS says otherwise; the workers read the count back
+    os.environ.setdefault("PIM_WORKERS", str(os.cpu_count() or 1))
+    settings = config.load_config()
+    if settings.in_memory and settings.workers > 1:
+        raise SystemExit("PIM_IN_MEMORY=1 gives every worker its own database; run a single worker")
+
+    database.configure(settings)
+    # Switch to WAL and run migrations before any worker can race on them
+    database.init_db()
+    stats.ensure_populated()
+    particles.backfill_previews()
+
+    # Calibrate once so every worker hashes at the same cost; otherwise workers
+    # with slightly different measurements would keep rehashing each other's hashes
+    if not settings.bcrypt_rounds:
+        os.environ["PIM_BCRYPT_CALIBRATION"] = json.dumps(auth.configure_bcrypt(settings))
+
+    uvicorn.run(
+        "main:create_app",
+        factory=True,
+        app_dir=str(config.BASE_DIR),
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+This file serves per-user particle statistics from the user_stats table.
+
+SQLite triggers on particles (see database.TRIGGERS) keep each user's row
+exact inside the same transaction as the write, so reading stats is one
+primary-key lookup. repair() recomputes the table from particles, for
+databases written before the triggers existed or edited by hand:
+
+    python stats.py              # repair every user
+    python stats.py --user alice
+"""
+
+import argparse
+import sqlite3
+from typing import Optional
+
+import config
+import database
+
+STAT_COLUMNS = ("particle_count", "total_bytes", "total_words")
+
+
+def get_stats(username: str) -> Optional[dict]:
+    """
+    Return the statistics of a user's particles.
+
+    Args:
+        username (str): Username.
+
+    Returns:
+        dict or None: {"username", "particle_count", "total_bytes", "total_words", "last_modified"},
+        or None if the user never had a particle.
+    """
+    conn = database.connect()
+    row = conn.execute(
+        "SELECT particle_count, total_bytes, total_words, last_modified FROM user_stats WHERE username = ?",
+        (username,),
+    ).fetchone()
+    conn.close()
+
+    if not row:
+        return None
+    return {"username": username, **dict(zip(STAT_COLUMNS, row[:3])), "last_modified": row[3]}
+
+
+def _repair(conn: sqlite3.Connection, username: Optional[str]) -> list:
+    """
+    Recompute user_stats rows inside the caller's write transaction.
+
+    last_modified can't be recomputed for deletes, so it only moves forward to
+    the newest stored revision.
+
+    Returns:
+        list[str]: Users whose counts were wrong.
+    """
+    where, params = ("WHERE username = ?", (username,)) if username is not None else ("", ())
+
+    stored = {
+        row[0]: row[1:]
+        for row in conn.execute(f"SELECT username, {', '.join(STAT_COLUMNS)}, last_modified FROM user_stats {where}", params)
+    }
+    actual = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f"SELECT username, COUNT(*), SUM(COALESCE(byte_size, 0)), SUM(COALESCE(word_count, 0)) "
+            f"FROM particles {where} GROUP BY username",
+            params,
+        )
+    }
+    edited = dict(
+        conn.execute(
+            f"SELECT p.username, MAX(r.created) FROM particle_revisions r "
+            f"JOIN particles p ON p.article_id = r.article_id {where.replace('username', 'p.username')} "
+            f"GROUP BY p.username",
+            params,
+        ).fetchall()
+    )
+
+    drifted = []
+    for user in sorted(stored.keys() | actual.keys()):
+        counts = actual.get(user, (0, 0, 0))
+        old = stored.get(user)
+        last_modified = max(filter(None, (old[3] if old else None, edited.get(user))), default=None)
+        if old and tuple(old[:3]) == tuple(counts) and old[3] == last_modified:
+            continue
+        if not old or tuple(old[:3]) != tuple(counts):
+            drifted.append(user)
+        conn.execute(
+            "INSERT INTO user_stats (username, particle_count, total_bytes, total_words, last_modified) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(username) DO UPDATE SET "
+            "particle_count = excluded.particle_count, total_bytes = excluded.total_bytes, "
+            "total_words = excluded.total_words, last_modified = excluded.last_modified",
+            (user, *counts, last_modified),
+        )
+    return drifted
+
+
+def repair(username: Optional[str] = None) -> list:
+    """
+    Recompute user_stats from the particles table.
+
+    Args:
+        username (Optional[str]): Only repair this user.
+
+    Returns:
+        list[str]: Users whose counts were wrong and have been fixed.
+    """
+    conn = database.connect()
+    try:
+        return database.execute_transaction(conn, lambda c: _repair(c, username))
+    finally:
+        conn.close()
+
+
+def ensure_populated() -> int:
+    """
+    Fill user_stats for a database that had particles before the triggers
+    existed. Must run before anything else writes to particles.
+
+    Returns:
+        int: Number of users filled in.
+    """
+    conn = database.connect()
+    empty = not conn.execute("SELECT 1 FROM user_stats LIMIT 1").fetchone()
+    has_particles = conn.execute("SELECT 1 FROM particles LIMIT 1").fetchone()
+    conn.close()
+    return len(repair()) if empty and has_particles else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="only repair this user")
+    args = parser.parse_args()
+
+    database.configure(config.load_config())
+    database.init_db()
+    drifted = repair(args.user)
+    for user in drifted:
+        print(f"repaired {user}")
+    print(f"{len(drifted)} user(s) had wrong statistics")
+
+
+if __name__ == "__main__":
+    main()
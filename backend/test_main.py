@@ -1,16 +1,57 @@
+import json
+import pstats
 import pytest
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from httpx import AsyncClient, ASGITransport
-from main import app
+import attachments
+import auth
+import config
+import database
+import leaderboard
+import particles
+import profiling
+import ratelimit
+import revisions
+import search
+import stats
+import writer
+from main import create_app
 
+# Every test run gets its own in-memory database instead of db/pim.db
+# bcrypt cost 4 keeps the many password checks in these tests fast
+app = create_app(config.Config(in_memory=True, blob_dir=Path(tempfile.mkdtemp()), bcrypt_rounds=4))
 transport = ASGITransport(app=app)
 
 TEST_USER = "testuser"
 TEST_PASS = "testpass"
+auth.add_new_user(TEST_USER, TEST_PASS)
 TEST_ARTICLE = {
     "title": "Sample Title",
     "content": "This is a sample article content."
 }
 
+@pytest.fixture
+def own_database():
+    """
+    Let a test configure databases of its own; the app's database (and its
+    data) is active again afterwards.
+    """
+    with database.preserved():
+        yield
+
+
+@pytest.fixture
+def reset_password():
+    """
+    Put TEST_USER in the state test_password_reset leaves it in, whatever ran before.
+    """
+    auth.reset_passwd(TEST_USER, "newpass123")
+
 @pytest.mark.asyncio
 async def test_health_check():
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
@@ -39,7 +80,7 @@ async def test_password_reset():
     assert r.status_code in (200, 404)
 
 @pytest.mark.asyncio
-async def test_create_article():
+async def test_create_article(reset_password):
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         payload = {
             "username": TEST_USER,
@@ -55,7 +96,7 @@ async def test_create_article():
 
 
 @pytest.mark.asyncio
-async def test_edit_delete_article():
+async def test_edit_delete_article(reset_password):
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
         create_resp = await ac.post("/particles/create", json={
             "username": TEST_USER,
@@ -80,3 +121,670 @@ async def test_edit_delete_article():
         r = await ac.delete(f"/particles/{article_id}")
         assert r.status_code in (200, 404)
 
+
+
+def test_token_bucket_sheds_after_burst():
+    limiter = ratelimit.TokenBucketLimiter(rate=0.001, burst=3)
+    assert [limiter.acquire("1.2.3.4") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("1.2.3.4") > 0
+    assert limiter.acquire("5.6.7.8") == 0.0
+
+
+def test_admission_sheds_when_no_slot_free():
+    controller = ratelimit.AdmissionController(
+        ip_limiter=ratelimit.TokenBucketLimiter(rate=1, burst=10),
+        user_limiter=ratelimit.TokenBucketLimiter(rate=1, burst=10),
+        max_concurrent=1,
+    )
+    with controller.admit("1.2.3.4", "alice"):
+        with pytest.raises(ratelimit.RateLimited):
+            with controller.admit("1.2.3.4", "bob"):
+                pass
+
+
+def test_admission_rejection_leaves_other_bucket_untouched():
+    controller = ratelimit.AdmissionController(
+        ip_limiter=ratelimit.TokenBucketLimiter(rate=0.001, burst=2),
+        user_limiter=ratelimit.TokenBucketLimiter(rate=0.001, burst=1),
+        max_concurrent=4,
+    )
+    with controller.admit("1.2.3.4", "alice"):
+        pass
+    with pytest.raises(ratelimit.RateLimited):
+        with controller.admit("1.2.3.4", "alice"):
+            pass
+    # The rejected attempt took no token from the IP bucket
+    with controller.admit("1.2.3.4", "bob"):
+        pass
+
+
+def test_admission_limits_come_from_config(own_database):
+    limited = create_app(config.Config(in_memory=True, bcrypt_rounds=4, auth_ip_burst=3, auth_user_rate=2.0))
+    assert limited.state.auth_admission.ip_limiter.burst == 3
+    assert limited.state.auth_admission.user_limiter.rate == 2.0
+
+
+def test_admission_limits_are_shared_between_workers(own_database):
+    limited = create_app(config.Config(
+        in_memory=True, bcrypt_rounds=4, workers=4, auth_ip_rate=2.0, auth_user_burst=5, auth_max_concurrent=8,
+    ))
+    admission = limited.state.auth_admission
+    assert admission.ip_limiter.rate == 0.5
+    assert admission.user_limiter.burst == 2
+    assert admission._slots._value == 2
+
+
+@pytest.mark.asyncio
+async def test_particle_writes_go_through_admission(own_database):
+    limited = create_app(config.Config(in_memory=True, bcrypt_rounds=4, auth_user_rate=0.001, auth_user_burst=1))
+    credentials = {"username": "nobody", "password": "wrong"}
+    async with AsyncClient(transport=ASGITransport(app=limited), base_url="http://test") as ac:
+        r = await ac.post("/particles/create", json={**credentials, "title": "t", "content": "c"})
+        assert r.status_code == 401
+        r = await ac.post("/particles/create", json={**credentials, "title": "t", "content": "c"})
+        assert r.status_code == 429
+        r = await ac.put("/particles/1/edit", json=credentials)
+        assert r.status_code == 429
+
+
+def test_bump_revision_is_visible_to_new_connections():
+    before = database.get_revision("test-cache")
+    conn = database.connect()
+    database.bump_revision(conn, "test-cache")
+    conn.commit()
+    conn.close()
+    assert database.get_revision("test-cache") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_register_then_duplicate():
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post("/auth/register", json={"username": "fresh", "password": "pw"})
+        assert r.status_code == 200
+        r = await ac.post("/auth/register", json={"username": "fresh", "password": "pw"})
+        assert r.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_attachment_dedup_and_range_download():
+    auth.add_new_user("attacher", "pw")
+    token = auth.login("attacher", "pw")
+    article_id = particles.create_article("attacher", "With files", "See attached")
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "text/plain"}
+    body = b"0123456789" * 1000
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post(f"/particles/{article_id}/attachments?filename=a.txt", content=body)
+        assert r.status_code == 403
+
+        first = await ac.post(f"/particles/{article_id}/attachments?filename=a.txt", content=body, headers=headers)
+        second = await ac.post(f"/particles/{article_id}/attachments?filename=b.txt", content=body, headers=headers)
+        assert first.status_code == second.status_code == 201
+        assert first.json()["sha256"] == second.json()["sha256"]
+        assert len(list(attachments.blob_path(first.json()["sha256"]).parent.iterdir())) == 1
+
+        r = await ac.get(f"/attachments/{first.json()['attachment_id']}", headers={"Range": "bytes=10-19"})
+        assert r.status_code == 206
+        assert r.content == body[10:20]
+
+        r = await ac.delete(f"/attachments/{first.json()['attachment_id']}", headers=headers)
+        assert r.status_code == 200
+        assert attachments.blob_path(second.json()["sha256"]).exists()
+
+        r = await ac.get(f"/particles/{article_id}/attachments")
+        assert r.json()["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_survives_concurrent_delete_of_last_reference():
+    article_id = particles.create_article(TEST_USER, "race", "body")
+
+    async def body(data):
+        yield data
+
+    sha256, size, staged = await attachments.store_blob(body(b"shared bytes"))
+    first = attachments.add_attachment(article_id, sha256, size, "a.txt", "text/plain", staged)
+
+    # Upload B has streamed the same content when A's row, the last reference, is deleted
+    sha256, size, staged = await attachments.store_blob(body(b"shared bytes"))
+    assert attachments.delete_attachment(first)
+    assert not attachments.blob_path(sha256).exists()
+    second = attachments.add_attachment(article_id, sha256, size, "b.txt", "text/plain", staged)
+
+    assert attachments.get_attachment(second)["path"].read_bytes() == b"shared bytes"
+    assert not staged.exists()
+
+
+@pytest.mark.asyncio
+async def test_list_returns_previews_unless_full():
+    content = "word " * 1000
+    article_id = particles.create_article("previewer", "Long", content)
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/particles/previewer")
+        item = r.json()["items"][0]
+        assert "content" not in item
+        assert item["preview"] == content[:particles.PREVIEW_CHARS]
+        assert item["word_count"] == 1000
+        assert item["byte_size"] == len(content)
+
+        r = await ac.get("/particles/previewer?full=1")
+        assert r.json()["items"][0]["content"] == content
+
+        r = await ac.get(f"/particles/{article_id}/view")
+        assert r.json()["content"] == content
+
+
+def test_list_query_is_covered_by_index():
+    conn = database.connect()
+    plan = conn.execute(
+        f"EXPLAIN QUERY PLAN SELECT {particles.LIST_COLUMNS} FROM particles WHERE username = ?", ("x",)
+    ).fetchall()
+    conn.close()
+    assert "COVERING INDEX" in plan[0][3]
+
+
+def test_session_lookup_uses_index():
+    conn = database.connect()
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT user_id, expiry FROM sessions WHERE token = ?", ("x",)).fetchall()
+    conn.close()
+    assert "idx_sessions_token" in plan[0][3]
+
+
+@pytest.mark.asyncio
+async def test_revisions_rebuild_every_version():
+    auth.add_new_user("historian", "pw")
+    content = "line of text\n" * 200
+    article_id = particles.create_article("historian", "v1", content)
+    versions = {1: content}
+    for n in range(2, 15):
+        content = content.replace("line", f"edit{n}", 1)
+        assert particles.edit_particle("historian", "pw", article_id, new_title=f"v{n}", new_content=content)
+        versions[n] = content
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get(f"/particles/{article_id}/revisions")
+        items = r.json()["items"]
+        assert [item["version"] for item in items] == list(range(14, 0, -1))
+        deltas = [item for item in items if item["kind"] == "delta"]
+        assert deltas and all(item["stored_size"] < 100 for item in deltas)
+
+        for n, expected in versions.items():
+            r = await ac.get(f"/particles/{article_id}/revisions/{n}")
+            assert r.json() == {"version": n, "title": f"v{n}", "content": expected}
+
+
+def test_create_stores_no_revision():
+    article_id = particles.create_article("historian", "fresh", "never edited")
+    conn = database.connect()
+    stored = conn.execute("SELECT COUNT(*) FROM particle_revisions WHERE article_id = ?", (article_id,)).fetchone()[0]
+    conn.close()
+    assert stored == 0
+    assert [(item["version"], item["kind"]) for item in revisions.list_revisions(article_id)] == [(1, "current")]
+    assert revisions.get_version(article_id, 1) == {"version": 1, "title": "fresh", "content": "never edited"}
+    assert revisions.get_version(article_id, 2) is None
+
+
+def test_revision_compaction_keeps_history_rebuildable():
+    article_id = particles.create_article("historian", "t", "start")
+    conn = database.connect()
+    content = "start"
+    for n in range(revisions.MAX_REVISIONS + revisions.SNAPSHOT_EVERY + 5):
+        old, content = content, content + f" w{n}"
+        database.execute_transaction(conn, lambda c: revisions.record(c, article_id, ("t", old), ("t", content), revisions.prepare(old, content)))
+    conn.close()
+
+    kept = revisions.list_revisions(article_id)
+    assert len(kept) <= revisions.MAX_REVISIONS + revisions.SNAPSHOT_EVERY
+    assert kept[-1]["kind"] == "snapshot"
+    assert revisions.get_version(article_id, kept[0]["version"])["content"] == content
+    assert revisions.get_version(article_id, kept[-1]["version"] - 1) is None
+
+
+def test_deltas_stay_cheap_on_large_repetitive_notes():
+    old = "lorem ipsum dolor " * 20000
+    local = old[:30000] + "changed " + old[30000:]
+    started = time.perf_counter()
+    delta = revisions.make_delta(old, local)
+    assert time.perf_counter() - started < 1
+    assert revisions.apply_delta(old, delta) == local
+
+    # Too large a changed region is not diffed at all, and a stale pre-read falls back to a snapshot
+    assert revisions.make_delta(old, old.replace("dolor", "sit")) is None
+    article_id = particles.create_article("historian", "t", old)
+    conn = database.connect()
+    database.execute_transaction(
+        conn, lambda c: revisions.record(c, article_id, ("t", old), ("t", local), revisions.prepare("stale", local))
+    )
+    conn.close()
+    assert revisions.list_revisions(article_id)[0]["kind"] == "snapshot"
+
+
+def test_in_memory_database_serves_concurrent_reads_and_writes():
+    article_id = particles.create_article("concurrent", "first", "body")
+    done = []
+
+    def read():
+        while not done:
+            particles.view_articles("concurrent")
+            assert particles.get_article_by_id(article_id)
+
+    def write(n):
+        return [particles.create_article("concurrent", f"t{n}-{i}", "body") for i in range(50)]
+
+    with ThreadPoolExecutor(8) as pool:
+        readers = [pool.submit(read) for _ in range(4)]
+        writers = [pool.submit(write, n) for n in range(4)]
+        try:
+            ids = [article for future in writers for article in future.result()]
+        finally:
+            done.append(True)
+        for future in readers:
+            future.result()
+    assert None not in ids and len(particles.view_articles("concurrent")) == 201
+
+
+def test_group_commit_batches_concurrent_writes():
+    writer.stop()
+    with ThreadPoolExecutor(16) as pool:
+        ids = list(pool.map(lambda n: particles.create_article("batcher", f"t{n}", "body"), range(64)))
+    assert len(set(ids)) == 64 and None not in ids
+    assert writer._queue.batches < writer._queue.operations
+
+
+def test_group_commit_isolates_failing_writes():
+    def bad(conn):
+        conn.execute("INSERT INTO particles (username, title, content) VALUES ('batcher', 'half', 'done')")
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(2) as pool:
+        failing = pool.submit(writer.submit, bad)
+        ok = pool.submit(particles.create_article, "batcher", "fine", "body")
+        with pytest.raises(ValueError):
+            failing.result()
+        assert ok.result()
+    titles = [item["title"] for item in particles.view_articles("batcher")]
+    assert "fine" in titles and "half" not in titles
+
+
+def test_stopped_write_queue_rejects_instead_of_hanging():
+    stopped = writer.WriteQueue(max_batch=8, window_ms=1)
+    stopped.stop()
+    with ThreadPoolExecutor(1) as pool:
+        late = pool.submit(stopped.submit, lambda conn: 1)
+        with pytest.raises(writer.QueueStopped):
+            late.result(timeout=2)
+
+    # A queue stopped under a caller is replaced and the write still runs
+    writer.submit(lambda conn: None)
+    writer._queue.stop()
+    assert particles.create_article("batcher", "after stop", "body")
+
+
+def test_duplicate_registration_skips_bcrypt(monkeypatch):
+    assert auth.add_new_user("taken", "pw")
+
+    def no_hashing(password):
+        raise AssertionError("bcrypt should not run")
+
+    monkeypatch.setattr(auth, "hash_password", no_hashing)
+    assert auth.add_new_user("taken", "pw") is False
+
+
+def test_unknown_user_lookups_skip_database(monkeypatch):
+    auth.load_user_index()
+    verified = []
+    monkeypatch.setattr(database, "connect", lambda: pytest.fail("database should not be queried"))
+    monkeypatch.setattr(auth, "dummy_verify", verified.append)
+
+    assert auth.get_user_details("ghost") is None
+    assert auth.reset_passwd("ghost", "pw") is False
+    assert auth.delete_user("ghost", "pw") is False
+    assert auth.login("ghost", "pw") is None
+    # Login still pays for one (dummy) bcrypt check
+    assert verified == ["pw"]
+
+
+def test_user_index_follows_other_workers(monkeypatch):
+    auth.load_user_index()
+    conn = database.connect()
+    database.execute_transaction(conn, lambda c: (
+        c.execute("INSERT INTO auth (username, password) VALUES ('elsewhere', 'x')"),
+        auth.log_username_change(c, "elsewhere", True),
+    ))
+    conn.close()
+
+    monkeypatch.setattr(database.settings(), "workers", 2)
+    monkeypatch.setattr(auth, "USER_INDEX_TTL", 0)
+    assert auth.user_exists("elsewhere")
+
+
+@pytest.mark.asyncio
+async def test_profile_on_request_and_download(monkeypatch, tmp_path):
+    monkeypatch.setattr(app.state.settings, "admin_key", "sekret")
+    monkeypatch.setattr(app.state.settings, "profile_dir", tmp_path)
+    admin = {"X-Admin-Key": "sekret"}
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.get("/particles/testuser")
+        r = await ac.get("/admin/profiles", headers=admin)
+        assert r.json()["count"] == 0
+
+        r = await ac.get("/particles/testuser", headers={"X-PIM-Profile": "sekret"})
+        assert r.status_code == 200
+
+        r = await ac.get("/admin/profiles")
+        assert r.status_code == 403
+        r = await ac.get("/admin/profiles", headers=admin)
+        profile = r.json()["items"][0]
+        assert profile["route"] == "/particles/{username}" or profile["path"] == "/particles/testuser"
+        assert profile["status"] == 200 and profile["sql_count"] >= 1
+
+        r = await ac.get(f"/admin/profiles/{profile['id']}?metadata=1", headers=admin)
+        assert any("FROM particles" in sql for sql in r.json()["sql"])
+        assert r.json()["shared_event_loop"] is False
+        r = await ac.get(f"/admin/profiles/{profile['id']}", headers=admin)
+        stats_file = tmp_path / "downloaded.prof"
+        stats_file.write_bytes(r.content)
+        assert pstats.Stats(str(stats_file)).total_calls > 0
+
+
+@pytest.mark.asyncio
+async def test_profile_logs_group_commit_writes_without_secrets(monkeypatch, tmp_path):
+    monkeypatch.setattr(app.state.settings, "admin_key", "sekret")
+    monkeypatch.setattr(app.state.settings, "profile_dir", tmp_path)
+    admin = {"X-Admin-Key": "sekret"}
+    auth.add_new_user("profiled", "pw")
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.post(
+            "/particles/create",
+            json={"username": "profiled", "password": "pw", **TEST_ARTICLE},
+            headers={"X-PIM-Profile": "sekret"},
+        )
+        assert r.status_code == 200
+        profile_id = (await ac.get("/admin/profiles", headers=admin)).json()["items"][0]["id"]
+        sql = (await ac.get(f"/admin/profiles/{profile_id}?metadata=1", headers=admin)).json()["sql"]
+
+    assert any(statement.startswith("INSERT INTO particles") for statement in sql)
+    secret = [statement for statement in sql if re.search(r"(?i)\b(from|into|update)\s+(auth|sessions)\b", statement)]
+    assert secret and not any("'" in statement for statement in secret)
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_saved_off_the_event_loop(monkeypatch, tmp_path):
+    monkeypatch.setattr(app.state.settings, "admin_key", "sekret")
+    monkeypatch.setattr(app.state.settings, "profile_dir", tmp_path)
+    loop_thread = threading.current_thread()
+    saved_on = []
+    save_profile = profiling.save_profile
+
+    def recording_save(*args):
+        saved_on.append(threading.current_thread())
+        return save_profile(*args)
+
+    monkeypatch.setattr(profiling, "save_profile", recording_save)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/health", headers={"X-PIM-Profile": "sekret"})
+    assert r.status_code == 200
+    assert saved_on and saved_on[0] is not loop_thread
+
+
+def test_calibration_meets_target():
+    # Cost 4 takes ~1 ms anywhere, so a 50 ms target always lands above the minimum
+    calibration = auth.calibrate_bcrypt(target_ms=50, min_rounds=4)
+    assert calibration["rounds"] > 4
+    assert calibration["measured_ms"] <= 50
+    assert str(calibration["rounds"]) in calibration["samples"]
+
+
+def test_calibration_times_the_cost_it_picks(monkeypatch):
+    # Costs 7 and 8 are slower than doubling from cost 6 predicts
+    timings = {4: 1.0, 5: 2.0, 6: 4.0, 7: 20.0, 8: 55.0, 9: 60.0}
+    timed = []
+    monkeypatch.setattr(auth, "_verify_ms", lambda rounds: timed.append(rounds) or timings[rounds])
+
+    calibration = auth.calibrate_bcrypt(target_ms=50, min_rounds=4)
+    assert calibration["rounds"] == 7 and calibration["measured_ms"] == 20.0
+    assert {7, 8} <= set(timed)
+    assert "7" not in calibration["estimated"] and "5" in calibration["estimated"]
+
+
+def test_workers_reuse_parent_calibration(monkeypatch):
+    parent = auth.calibrate_bcrypt(target_ms=5, min_rounds=4)
+    monkeypatch.setenv("PIM_BCRYPT_CALIBRATION", json.dumps(parent))
+    monkeypatch.delenv("PIM_BCRYPT_ROUNDS", raising=False)
+    monkeypatch.setattr(auth, "_bcrypt_calibration", None)
+    monkeypatch.setattr(auth, "_bcrypt_rounds", 4)
+
+    assert auth.configure_bcrypt(config.load_config()) == parent
+    assert auth.bcrypt_report()["calibration"]["calibrated_at"] == parent["calibrated_at"]
+
+
+def test_user_index_applies_other_workers_changes_incrementally(monkeypatch):
+    monkeypatch.setattr(database.settings(), "workers", 2)
+    assert auth.add_new_user("leaving", "pw")
+    auth.user_exists("leaving")
+
+    conn = database.connect()
+    database.execute_transaction(conn, lambda c: (
+        c.execute("INSERT INTO auth (username, password) VALUES ('arriving', 'x')"),
+        auth.log_username_change(c, "arriving", True),
+        c.execute("DELETE FROM auth WHERE username = 'leaving'"),
+        auth.log_username_change(c, "leaving", False),
+    ))
+    conn.close()
+
+    monkeypatch.setattr(auth, "load_user_index", lambda: pytest.fail("index should not be reloaded in full"))
+    assert auth.user_exists("arriving")
+    assert "leaving" not in auth._user_index
+
+
+def test_workers_default_to_one_outside_serve(monkeypatch):
+    monkeypatch.delenv("PIM_WORKERS", raising=False)
+    assert config.load_config().workers == 1
+
+
+def test_user_index_sees_other_workers_registrations(monkeypatch):
+    monkeypatch.setattr(database.settings(), "workers", 2)
+    assert not auth.user_exists("freshsignup")
+
+    # Another worker registers the user; this worker's TTL has not run out
+    conn = database.connect()
+    database.execute_transaction(conn, lambda c: (
+        c.execute("INSERT INTO auth (username, password) VALUES ('freshsignup', 'x')"),
+        auth.log_username_change(c, "freshsignup", True),
+    ))
+    conn.close()
+    monkeypatch.setattr(auth, "_user_index_checked", time.monotonic())
+
+    assert auth.user_exists("freshsignup")
+
+
+def stored_cost(username):
+    auth._rehash_executor.submit(lambda: None).result()  # wait for any queued rehash
+    conn = database.connect()
+    stored = conn.execute("SELECT password FROM auth WHERE username = ?", (username,)).fetchone()[0]
+    conn.close()
+    return auth.hash_cost(stored)
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_outdated_cost(monkeypatch):
+    monkeypatch.setattr(auth, "_bcrypt_rounds", 4)
+    assert auth.add_new_user("oldcost", "pw")
+    monkeypatch.setattr(auth, "_bcrypt_rounds", 5)
+
+    assert auth.login("oldcost", "pw")
+    assert stored_cost("oldcost") == 5
+    assert auth.login("oldcost", "pw")
+
+    monkeypatch.setattr(app.state.settings, "admin_key", "sekret")
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/admin/bcrypt", headers={"X-Admin-Key": "sekret"})
+    assert r.json()["rounds"] == 5
+    assert r.json()["cost_distribution"]["5"] >= 1
+
+
+def test_login_keeps_stronger_hash(monkeypatch):
+    monkeypatch.setattr(auth, "_bcrypt_rounds", 6)
+    assert auth.add_new_user("strongcost", "pw")
+    monkeypatch.setattr(auth, "_bcrypt_rounds", 4)
+
+    assert auth.login("strongcost", "pw")
+    assert stored_cost("strongcost") == 6
+
+
+@pytest.mark.asyncio
+async def test_top_particles_by_views():
+    first = particles.create_article("ranker", "First", "one")
+    second = particles.create_article("ranker", "Second", "two")
+    for _ in range(3):
+        particles.particles_view_adder(second)
+    particles.particles_view_adder(first)
+
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get(f"/particles/{first}/view")
+        assert r.json()["views"] == 1
+        r = await ac.get(f"/particles/{first}/view?count_view=1")
+        assert r.json()["views"] == 2
+
+        r = await ac.get("/particles/top?username=ranker&limit=1")
+        assert r.json()["items"] == [{"particle_id": second, "username": "ranker", "title": "Second", "views": 3}]
+
+        r = await ac.get("/particles/top?username=ranker&window=24h")
+        assert [item["views"] for item in r.json()["items"]] == [3, 2]
+
+        r = await ac.get("/particles/top?window=1y")
+        assert r.status_code == 400
+
+
+def test_top_query_walks_views_index():
+    conn = database.connect()
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT article_id FROM particles WHERE username = ? ORDER BY views DESC LIMIT 10", ("x",)
+    ).fetchall()
+    conn.close()
+    assert not any("TEMP B-TREE" in row[3] for row in plan)
+
+
+def test_view_windows_expire():
+    article_id = particles.create_article("trender", "Trend", "hot")
+    now = 1_000_000 * leaderboard.BUCKET_SECONDS
+    conn = database.connect()
+    database.execute_transaction(conn, lambda c: leaderboard.record_view(c, article_id, now=now))
+    conn.close()
+
+    def views(window, hours_later):
+        items = leaderboard.top(username="trender", window=window, now=now + hours_later * leaderboard.BUCKET_SECONDS)
+        return [item["views"] for item in items]
+
+    assert views("24h", 23) == [1]
+    assert views("24h", 24) == []
+    assert views("7d", 24) == [1]
+    assert views("7d", 7 * 24) == []
+
+    conn = database.connect()
+    assert conn.execute("SELECT COUNT(*) FROM particle_view_buckets WHERE article_id = ?", (article_id,)).fetchone()[0] == 0
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_user_stats_follow_particle_writes():
+    auth.add_new_user("counter", "pw")
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/particles/counter/stats")
+        assert r.json()["particle_count"] == 0
+
+        first = particles.create_article("counter", "A", "one two")
+        second = particles.create_article("counter", "B", "three")
+        particles.edit_particle("counter", "pw", first, new_content="one two four")
+        particles.delete_article(second)
+
+        r = await ac.get("/particles/counter/stats")
+        body = r.json()
+        assert (body["particle_count"], body["total_bytes"], body["total_words"]) == (1, 12, 3)
+        assert body["last_modified"] is not None
+
+        r = await ac.get("/particles/nobody-here/stats")
+        assert r.status_code == 404
+
+
+def test_stats_repair_fixes_drift():
+    particles.create_article("drifter", "A", "some words here")
+    conn = database.connect()
+    conn.execute("UPDATE user_stats SET particle_count = 7, total_bytes = 0 WHERE username = 'drifter'")
+    conn.commit()
+    conn.close()
+
+    assert stats.repair("drifter") == ["drifter"]
+    assert stats.get_stats("drifter")["particle_count"] == 1
+    assert stats.get_stats("drifter")["total_bytes"] == len("some words here")
+    assert stats.repair("drifter") == []
+
+
+@pytest.mark.asyncio
+async def test_admin_search_streams_ranked_results(monkeypatch):
+    weak = particles.create_article("searcher-a", "Plain", "one zebra here")
+    strong = particles.create_article("searcher-b", "Zebra facts", "zebra zebra")
+    particles.create_article("searcher-a", "Other", "100% unrelated")
+
+    monkeypatch.setattr(app.state.settings, "admin_key", "sekret")
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        r = await ac.get("/admin/search?q=zebra")
+        assert r.status_code == 403
+
+        r = await ac.get("/admin/search?q=zebra&limit=2", headers={"X-Admin-Key": "sekret"})
+        lines = [json.loads(line) for line in r.text.splitlines()]
+    assert r.headers["content-type"] == "application/x-ndjson"
+    assert lines[-1]["done"]
+    assert [item["article_id"] for item in lines[-1]["items"]] == [strong, weak]
+    assert sum(len(line["items"]) for line in lines[:-1]) == 2
+
+    found = [chunk async for chunk in search.search_all("%", 10)]
+    assert [item["title"] for item in found[-1]["items"]] == ["Other"]
+
+
+@pytest.mark.asyncio
+async def test_admin_search_scores_non_ascii_terms():
+    article_id = particles.create_article("searcher-c", "Über", "Über alles, ÜBER nichts")
+    found = [chunk async for chunk in search.search_all("Über", 10)]
+    scores = {item["article_id"]: item["score"] for item in found[-1]["items"]}
+    # LIKE and LOWER() fold ASCII only: "ÜBER" matches (B, E, R fold) but "über" would not
+    assert scores == {article_id: search.TITLE_WEIGHT + 2}
+
+
+def test_search_pool_is_split_between_workers():
+    assert search.pool_size(config.Config(workers=4, search_workers=8)) == 2
+    assert search.pool_size(config.Config(workers=64, search_workers=8)) == 1
+
+
+@pytest.mark.asyncio
+async def test_admin_search_in_process_pool(tmp_path, own_database):
+    database.configure(config.Config(db_path=tmp_path / "search.db", search_workers=2, group_commit=False))
+    database.init_db()
+    for n in range(40):
+        particles.create_article("poolsearch", f"Note {n}", "needle " * (n % 5) + "hay")
+
+    chunks = [chunk async for chunk in search.search_all("needle", 3)]
+    assert len(chunks[-1]["items"]) == 3
+    assert all(item["score"] == 4 for item in chunks[-1]["items"])
+    assert sum(len(chunk["items"]) for chunk in chunks[:-1]) <= 3 * chunks[-1]["ranges"]
+
+    # Stopping early cancels the ranges still queued
+    stream = search.search_all("needle", 3)
+    await stream.__anext__()
+    await stream.aclose()
+
+    search.shutdown()
+
+
+def test_snapshot_round_trip(tmp_path, own_database):
+    snapshot = tmp_path / "snapshot.db"
+    database.configure(config.Config(in_memory=True))
+    database.init_db()
+    assert auth.add_new_user("snap", "pw")
+    database.save_snapshot(snapshot)
+
+    database.configure(config.Config(in_memory=True, snapshot_path=snapshot))
+    assert auth.get_user_details("snap")["username"] == "snap"
@@ -0,0 +1,203 @@
+"""
+This file batches particle writes into group commits.
+
+Callers hand a write (a function of a connection) to a single writer thread
+and wait for its result. A profiled caller's statement log travels with its
+write, so the writer's SQL shows up in that request's profile. The writer takes everything that arrives within a
+short window, runs each write under its own SAVEPOINT inside one transaction
+and commits once, so N concurrent writes cost one commit instead of N while
+each caller still sees only its own result or exception.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+import database
+
+
+class QueueStopped(RuntimeError):
+    """
+    Raised by WriteQueue.submit once the queue has been stopped; the write was not queued.
+    """
+
+
+class WriteQueue:
+    """
+    A writer thread that group-commits submitted writes.
+    """
+
+    def __init__(self, max_batch: int, window_ms: float):
+        """
+        Args:
+            max_batch (int): Most writes committed together.
+            window_ms (float): How long to keep collecting after the first write arrives.
+        """
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._lock = threading.Lock()  # orders submits against stop(), so nothing is queued after the sentinel
+        self._thread = threading.Thread(target=self._run, name="pim-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Run a write in the next group commit and wait for it.
+
+        Args:
+            work (Callable[[sqlite3.Connection], Any]): Statements to run; may run more than once.
+
+        Returns:
+            Any: Whatever work returned, once its batch has committed.
+
+        Raises:
+            QueueStopped: If stop() was called already.
+            Exception: Whatever work raised; other writes in the batch are unaffected.
+        """
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                raise QueueStopped("write queue is stopped")
+            self._queue.put((work, future, database.statement_log.get()))
+        return future.result()
+
+    def stop(self) -> None:
+        """
+        Finish queued writes and stop the writer thread. Later submits raise QueueStopped.
+        """
+        with self._lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> Optional[list]:
+        """
+        Block for one write, then gather more until the window closes or the batch is full.
+
+        Returns:
+            Optional[list]: (work, future, statement log) items, or None once stop() was called.
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Commit what we have, then let the next _collect see the stop request
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        conn = database.connect()
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+
+            def run_batch(conn):
+                outcomes = []
+                for work, _, log in batch:
+                    conn.execute("SAVEPOINT op")
+                    # Only the caller's own statements go to its log
+                    conn.set_trace_callback(database.trace_callback(log) if log is not None else None)
+                    try:
+                        outcomes.append((True, work(conn)))
+                    except sqlite3.OperationalError as e:
+                        if database.is_locked(e):
+                            raise  # retry the whole batch
+                        conn.execute("ROLLBACK TO op")
+                        outcomes.append((False, e))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        outcomes.append((False, e))
+                    finally:
+                        conn.set_trace_callback(None)
+                    conn.execute("RELEASE op")
+                return outcomes
+
+            try:
+                outcomes = database.execute_transaction(conn, run_batch)
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+
+            self.batches += 1
+            self.operations += len(batch)
+            for (_, future, _), (ok, value) in zip(batch, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        conn.close()
+
+
+_queue = None
+_queue_settings = None
+_queue_lock = threading.Lock()
+
+
+def submit(work: Callable[[sqlite3.Connection], Any]) -> Any:
+    """
+    Run a write through the group-commit queue of the configured database, or
+    directly in its own transaction when group commit is disabled.
+
+    Args:
+        work (Callable[[sqlite3.Connection], Any]): Statements to run; may run more than once.
+
+    Returns:
+        Any: Whatever work returned.
+    """
+    settings = database.settings()
+    if not settings.group_commit:
+        conn = database.connect()
+        try:
+            return database.execute_transaction(conn, work)
+        finally:
+            conn.close()
+
+    global _queue, _queue_settings
+    while True:
+        with _queue_lock:
+            # The writer holds a connection, so start a new one if the database was reconfigured
+            if _queue_settings is not settings:
+                if _queue is not None:
+                    _queue.stop()
+                _queue = WriteQueue(settings.group_commit_max_batch, settings.group_commit_window_ms)
+                _queue_settings = settings
+            write_queue = _queue
+        try:
+            return write_queue.submit(work)
+        except QueueStopped:
+            # Stopped between the lookup and the enqueue; the write never ran, so queue it again
+            settings = database.settings()
+            with _queue_lock:
+                if _queue is write_queue:
+                    _queue = None
+                    _queue_settings = None
+
+
+def stop() -> None:
+    """
+    Flush and stop the writer thread, if one is running.
+    """
+    global _queue, _queue_settings
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+        _queue = None
+        _queue_settings = None
@@ -269,32 +269,36 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         // Global functions for article operations
-        window.editArticleClick = (articleId) => {
+        // The list only carries previews, so fetch the full article before showing it.
+        // Only the view action counts towards the most-viewed rankings.
+        async function fetchArticle(articleId, countView = false) {
+            const query = countView ? '?count_view=1' : '';
+            const response = await fetch(`${apiBaseUrl}/particles/${articleId}/view${query}`);
+            if (!response.ok) {
+                throw new Error('Failed to load article');
+            }
+            return response.json();
+        }
+
+        window.editArticleClick = async (articleId) => {
             currentEditingId = articleId;
             viewMode = false;
             modalTitle.textContent = 'Edit Article';
 
-            // Find the article data and populate the form
-            const articleCard = document.querySelector(
-                `[data-article-id="${articleId}"]`
-            );
-            const title = articleCard.querySelector('.article-title').textContent;
-            const content = articleCard.querySelector('.article-content').textContent;
+            const article = await fetchArticle(articleId);
 
-            document.getElementById('article-title').value = title;
-            document.getElementById('article-content').value = content;
+            document.getElementById('article-title').value = article.title;
+            document.getElementById('article-content').value = article.content;
             setModalEditable(true);
             modal.style.display = 'block';
         };
 
-        window.viewArticleClick = (articleId) => {
-            const articleCard = document.querySelector(`[data-article-id="${articleId}"]`);
-            const title = articleCard.querySelector('.article-title').textContent;
-            const content = articleCard.querySelector('.article-content').textContent;
+        window.viewArticleClick = async (articleId) => {
+            const article = await fetchArticle(articleId, true);
 
             modalTitle.textContent = 'View Article';
-            document.getElementById('article-title').value = title;
-            document.getElementById('article-content').value = content;
+            document.getElementById('article-title').value = article.title;
+            document.getElementById('article-content').value = article.content;
             setModalEditable(false);
             viewMode = true;
             modal.style.display = 'block';
@@ -402,7 +406,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         }')">Delete</button>
                     </div>
                 </div>
-                <div class="article-content">${escapeHtml(article.content)}</div>
+                <div class="article-content">${escapeHtml(article.preview)}</div>
                 <div class="article-meta">
                     <span>ID: ${article.particle_id || article.article_id}</span>
                 </div>